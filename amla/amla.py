@@ -49,6 +49,19 @@ class AmlaCLI(cmd.Cmd):
     def do_add_task(self, arg):
         'Add a task to the scheduler task list'
         self.amla.add_task(self.parse(arg)[0])
+    def do_add_tasks(self, arg):
+        'Add a list of tasks to the scheduler task list in a single request'
+        self.amla.add_tasks(self.parse(arg))
+    def do_update_tasks(self, arg):
+        'Set the state of a list of tasks in a single request: task_id:state ...'
+        tasks = []
+        for item in self.parse(arg):
+            if ":" not in item:
+                print("Error: Expected task_id:state, got " + item)
+                return
+            task_id, state = item.split(":", 1)
+            tasks.append({"task_id": int(task_id), "state": state})
+        self.amla.update_tasks(tasks)
     def do_delete_task(self, arg):
         'Set configuration'
         self.amla.delete_task(self.parse(arg)[0])
@@ -98,6 +111,17 @@ class Amla(Task):
         task = self.send_request("scheduler", "tasks/add", parameters)
         print("Added task: " + str(task) + " to schedule.")
 
+    def add_tasks(self, configs):
+        tasks = [{"config": config} for config in configs]
+        parameters = {"tasks": tasks, "op": "POST"}
+        tasks = self.send_request("scheduler", "tasks/add_batch", parameters)
+        print("Added tasks: " + str(tasks) + " to schedule.")
+
+    def update_tasks(self, tasks):
+        parameters = {"tasks": tasks, "op": "POST"}
+        self.send_request("scheduler", "tasks/update_batch", parameters)
+        print("Updated tasks: " + str([task["task_id"] for task in tasks]))
+
     def delete_task(self, task_id):
         parameters = {"task_id": int(task_id), "op": "POST"}
         self.send_request("scheduler", "tasks/delete", parameters)
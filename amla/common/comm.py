@@ -15,8 +15,12 @@
 """
 
 import json
+import time
 import requests
 
+RETRIES = 10
+MAX_DELAY = 5.0
+
 class Comm():
     """Base communication class
     Abstracts message sending/receive methods (REST client/?)
@@ -29,16 +33,22 @@ class Comm():
 
     def send_request(self, service, operation, parameters):
         """Makes a REST call (GET/POST)
+        Retried with backoff while the service answers Busy (503)
         """
         host = self.sys_config['host'][service]
         port = self.sys_config['port'][service]
         url = "http://" + host + ":" + str(port) + "/api/v1.0/"+operation
-        if parameters['op'] == 'GET':
-            del parameters['op']
-            response = requests.get(url, json=parameters)
-        elif parameters['op'] == 'POST':
-            del parameters['op']
-            response = requests.post(url, json=parameters)
+        op = parameters.pop('op')
+        delay = 0.1
+        for attempt in range(RETRIES):
+            if op == 'GET':
+                response = requests.get(url, json=parameters)
+            elif op == 'POST':
+                response = requests.post(url, json=parameters)
+            if response.status_code != 503 or attempt == RETRIES - 1:
+                break
+            time.sleep(delay)
+            delay = min(2 * delay, MAX_DELAY)
         if not response.ok:
             print("Comm: Error sending message")
         return json.loads(response.text)
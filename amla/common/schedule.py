@@ -14,238 +14,628 @@
 """Task Schedule
 """
 
+import os
 import collections
-import operator
+import contextlib
+import heapq
 import json
+import queue
+import threading
+
+class TaskGraph():
+    """
+    Dependency graph of tasks
+    Edges are stored in both directions: the tasks a task is waiting for,
+    and the tasks waiting for a task. Each waiting task keeps a count of
+    the tasks it is still waiting for. When a task is released (i.e. it
+    completes) the counts of its dependents are decremented, and the
+    dependents whose count reaches zero are returned as ready
+    """
+    def __init__(self):
+        self.waiting_for = {}
+        self.dependents = collections.defaultdict(set)
+        self.pending = {}
+        self.released = set()
+
+    def add_edges(self, task_id, deps):
+        """Make task_id wait for the tasks in deps
+        Returns True if none of deps is outstanding (i.e. task_id is ready)
+        """
+        self.remove_edges(task_id)
+        self.waiting_for[task_id] = set()
+        pending = 0
+        for dep in deps:
+            if dep in self.released or dep in self.waiting_for[task_id]:
+                continue
+            self.waiting_for[task_id].add(dep)
+            self.dependents[dep].add(task_id)
+            pending += 1
+        self.pending[task_id] = pending
+        return pending == 0
+
+    def remove_edges(self, task_id):
+        """Remove the edges from task_id to the tasks it is waiting for"""
+        for dep in self.waiting_for.pop(task_id, ()):
+            self.dependents[dep].discard(task_id)
+            if not self.dependents[dep]:
+                del self.dependents[dep]
+        self.pending.pop(task_id, None)
+
+    def is_ready(self, task_id):
+        return self.pending.get(task_id, 0) == 0
+
+    def release(self, task_id):
+        """Mark task_id as complete
+        Returns the list of dependents that are now ready. Releasing a task
+        more than once has no further effect
+        """
+        ready = []
+        if task_id in self.released:
+            return ready
+        self.released.add(task_id)
+        for waiter in self.dependents.pop(task_id, ()):
+            self.waiting_for[waiter].discard(task_id)
+            self.pending[waiter] -= 1
+            if self.pending[waiter] == 0:
+                ready.append(waiter)
+        return ready
+
+    def remove(self, task_id):
+        """Remove task_id from the graph
+        Returns the list of dependents that are now ready
+        """
+        self.remove_edges(task_id)
+        ready = self.release(task_id)
+        self.released.discard(task_id)
+        return ready
 
 class Schedule():
     """
     Base class for schedule
     TODO: Make ABC
     A task is in one of 3 states: init, running, waiting, complete
+    A waiting task is schedulable once all the tasks it is waiting for
+    are complete
     """
     def __init__(self):
         return
-    
-    def get_next_task(self, tasks):
-          """ 
-          Scheduling algorthm
-          Find oldest task where state is "init"
-          or "waiting" and "waitingfor" are completed
-          TODO: Topological sort of task graph
-          """
-          if len(tasks) == 0:
-              return None
-          else:
-              schedulable =[]
-              for task in tasks:
-                  if task["state"] == "init":
-                     schedulable.append(task)
-                  elif task["state"] == "waiting":
-                     schedule = True
-                     for task_id in task["waiting_for"]:
-                         #Search for task in schedule
-                         #TODO: Create an index
-                         for t in tasks:
-                             if task_id == t["task_id"]:
-                                 if t["state"] != "complete":
-                                     schedule = False
-                                     break
-                     if schedule == True:
-                         schedulable.append(task)
-                         #After the tasks complete, then the iteration needs to be 
-                         #increased before this task is resumed 
-                         #TODO: Specific to generate tasks
-                         #Move elsewhere?
-                         task['iteration']+=1
-                         task['state'] = 'running'
-                         task['waiting_for'] = [];
-              task = None
-              #TODO: Sort schedulable based on task id
-              if len(schedulable) > 0:
-                  schedulable.sort(key=operator.itemgetter('task_id'))
-                  task = schedulable[0]
-                  task['state'] = 'running'
-                  task['waiting_for'] = [];
-              return task
+
+    def start(self, task):
+        """Move a schedulable task to the running state
+        """
+        if task['state'] == 'waiting':
+            #After the tasks complete, then the iteration needs to be
+            #increased before this task is resumed
+            #TODO: Specific to generate tasks
+            #Move elsewhere?
+            task['iteration'] += 1
+        task['state'] = 'running'
+        task['waiting_for'] = []
+        return task
 
 class ScheduleMem(Schedule):
     """
     Implements a schedule of tasks stored in memory
     Can be used only when AMLA is used in single host mode
-    Currently a FIFO queue, stored in memory implemented using python's deque
-    Note: Not safe for concurrent access
-    TODO:
+    Tasks are indexed by task_id. Tasks that can be scheduled are kept in
+    a heap ordered by task_id (oldest task first).
+    Dependencies between tasks are kept in a TaskGraph, so that a waiting
+    task is pushed on the heap as soon as the tasks it waits for complete,
+    and get_next and update are O(log N)
+    Safe for concurrent access from the scheduler's threads
     """
     def __init__(self):
         #TODO: Assert in single host mode
-        self.tasks = collections.deque()
+        self.tasks = {}
+        self.ready = []
+        self.graph = TaskGraph()
+        self.lock = threading.Lock()
         self.nexttask_id = 0
         return
 
     def add(self, t):
         """ Add a task to the schedule
         """
+        with self.lock:
+            return dict(self.insert(t))
+
+    def insert(self, t):
         task_id = self.nexttask_id
-        task = {'task_id': task_id, 'config': t['config'], 'state': 'init'}
+        task = {'task_id': task_id, 'config': t['config'], 'state': 'init',
+                'waiting_for': []}
         if 'iteration' in t:
            task['iteration'] = t['iteration']
         else:
            task['iteration'] = 0
-        self.tasks.append(task)
+        self.tasks[task_id] = task
+        heapq.heappush(self.ready, task_id)
         self.nexttask_id += 1
         return task
 
+    def wait_for(self, task, new_tasks):
+        """Add new_tasks, and set task waiting for them
+        """
+        with self.lock:
+            self.expand(task, new_tasks)
+        return task
+
+    def expand(self, task, new_tasks):
+        task['waiting_for'] = []
+        for t in new_tasks:
+            t['iteration'] = task['iteration']
+            new_task = self.insert(t)
+            t['task_id'] = new_task['task_id']
+            task['waiting_for'].append(new_task['task_id'])
+        task['state'] = 'waiting'
+        self.merge(task)
+
+    def add_batch(self, tasks):
+        """ Add a list of tasks to the schedule
+        """
+        with self.lock:
+            return [dict(self.insert(t)) for t in tasks]
+
     def update(self, task):
-        for elem in self.tasks:
-            if elem['task_id'] == task['task_id']:
-                for key in task:
-                    elem[key] = task[key]
+        with self.lock:
+            self.merge(task)
         return
 
+    def update_batch(self, tasks):
+        """Update a list of tasks
+        Tasks with new_tasks are set waiting for them (see wait_for)
+        """
+        with self.lock:
+            for task in tasks:
+                if 'new_tasks' in task:
+                    self.expand(task, task.pop('new_tasks'))
+                else:
+                    self.merge(task)
+        return
+
+    def merge(self, task):
+        if task['task_id'] not in self.tasks:
+            return
+        elem = self.tasks[task['task_id']]
+        state = elem['state']
+        waiting_for = list(elem.get('waiting_for', []))
+        for key in task:
+            elem[key] = task[key]
+        #A waiting task may be updated with new tasks to wait for
+        if elem['state'] != state or (elem['state'] == 'waiting' and
+                elem.get('waiting_for', []) != waiting_for):
+            self.set_state(elem)
+
+    def set_state(self, task):
+        """Update the ready heap and the dependency counts after
+        a task moves to task['state'], or changes the tasks it waits for
+        """
+        task_id = task['task_id']
+        if task['state'] == 'init':
+            heapq.heappush(self.ready, task_id)
+        elif task['state'] == 'waiting':
+            deps = [dep for dep in task.get('waiting_for', []) if dep in self.tasks]
+            if self.graph.add_edges(task_id, deps):
+                heapq.heappush(self.ready, task_id)
+        elif task['state'] == 'complete':
+            for waiter in self.graph.release(task_id):
+                heapq.heappush(self.ready, waiter)
+
     def delete(self, task):
         if  not task:
             return -1
-        for elem in self.tasks:
-            if elem['task_id'] == task['task_id']:
-                break
+        with self.lock:
+            task_id = task['task_id']
+            if task_id in self.tasks:
+                del self.tasks[task_id]
+                #Tasks waiting for a deleted task are no longer blocked by it
+                for waiter in self.graph.remove(task_id):
+                    heapq.heappush(self.ready, waiter)
         return task['task_id']
 
     def get(self, task):
-        elem = None
-        for elem in self.tasks:
-            if elem['task_id'] == task['task_id']:
-                break
+        #Return copies, so that the ready heap is only changed by update
+        elem = self.tasks.get(task['task_id'])
+        if elem is not None:
+            elem = dict(elem)
         return elem
 
     def get_next(self):
         """Get the next task to be scheduled
-         Currently uses a FIFO queue
+        Pops the oldest schedulable task from the ready heap. Entries for
+        tasks that were deleted or have since been started are skipped
         """
-        if len(self.tasks) == 0:
+        with self.lock:
+            while self.ready:
+                task_id = heapq.heappop(self.ready)
+                if task_id not in self.tasks:
+                    continue
+                task = self.tasks[task_id]
+                if task['state'] == 'init' or (task['state'] == 'waiting' and
+                        self.graph.is_ready(task_id)):
+                    self.graph.remove_edges(task_id)
+                    self.start(task)
+                    return dict(task)
             return None
-        else:
-            task = self.get_next_task(self.tasks)
-            return task
 
     def get_all(self):
-        return list(self.tasks)
+        with self.lock:
+            return [dict(task) for task in self.tasks.values()]
 
 class ScheduleDB(Schedule):
     """
     Implements a schedule of tasks stored in a DB
-    Currently uses mysql, with transactions to support 
+    Currently uses mysql, with transactions to support
     concurrent schedulers
+    The task graph is stored in a dependency table, with an index in both
+    directions. Each task has a count of the tasks it is waiting for
+    (pending), which is decremented when one of these tasks is released,
+    so a waiting task becomes schedulable without re-checking its
+    dependencies
+    Connections are taken from a small pool, one per transaction, so that
+    the scheduler's request threads and poll thread never share a cursor
+    All statements are parameterized
     """
     def __init__(self, sys_config):
         import MySQLdb
+        self.error = MySQLdb.Error
         host = sys_config["database"]["host"]
         user = sys_config["database"]["user"]
         passwd = sys_config["database"]["password"]
         db = sys_config["database"]["db"]
-        self.db = MySQLdb.connect(host=host,
-                     user=user,
-                     passwd=passwd,
-                     db=db)
-
-        self.cur = self.db.cursor()
-        query = "CREATE TABLE IF NOT EXISTS schedule ( \
-            task_id INT(11) NOT NULL AUTO_INCREMENT, \
-            config VARCHAR(1024) DEFAULT NULL, \
-            state VARCHAR(32) DEFAULT 'init', \
-            steps INT(11) DEFAULT 0, \
-            iteration INT(11) DEFAULT 0, \
-            waiting_for VARCHAR(1024) DEFAULT NULL, \
-            PRIMARY KEY(task_id)) ENGINE=InnoDB;"
-        self.cur.execute(query)
-        self.db.commit()
+        pool_size = 4
+        if "pool_size" in sys_config["database"]:
+            pool_size = int(sys_config["database"]["pool_size"])
+        self.pool = queue.Queue()
+        for _ in range(pool_size):
+            conn = MySQLdb.connect(host=host,
+                         user=user,
+                         passwd=passwd,
+                         db=db)
+            conn.autocommit(False)
+            self.pool.put(conn)
+
+        with self.transaction() as cur:
+            query = "CREATE TABLE IF NOT EXISTS schedule ( \
+                task_id INT(11) NOT NULL AUTO_INCREMENT, \
+                config VARCHAR(1024) DEFAULT NULL, \
+                state VARCHAR(32) DEFAULT 'init', \
+                steps INT(11) DEFAULT 0, \
+                iteration INT(11) DEFAULT 0, \
+                waiting_for VARCHAR(1024) DEFAULT NULL, \
+                pending INT(11) DEFAULT 0, \
+                released TINYINT(1) DEFAULT 0, \
+                PRIMARY KEY(task_id), \
+                KEY state_task (state, task_id)) ENGINE=InnoDB;"
+            cur.execute(query)
+            #Schedules created before the task graph was added
+            cur.execute("SHOW COLUMNS FROM schedule LIKE 'pending';")
+            if cur.fetchone() is None:
+                cur.execute("ALTER TABLE schedule \
+                    ADD COLUMN pending INT(11) DEFAULT 0, \
+                    ADD COLUMN released TINYINT(1) DEFAULT 0;")
+            cur.execute("SHOW INDEX FROM schedule WHERE Key_name = 'state_task';")
+            if cur.fetchone() is None:
+                cur.execute("CREATE INDEX state_task ON schedule (state, task_id);")
+            query = "CREATE TABLE IF NOT EXISTS dependency ( \
+                task_id INT(11) NOT NULL, \
+                waiting_for INT(11) NOT NULL, \
+                PRIMARY KEY(task_id, waiting_for), \
+                KEY dependents (waiting_for, task_id)) ENGINE=InnoDB;"
+            cur.execute(query)
+        #SKIP LOCKED requires MySQL 8.0 or MariaDB 10.6. Older servers fall
+        #back to the conditional update in get_next
+        self.skip_locked = True
+        try:
+            with self.transaction() as cur:
+                cur.execute("SELECT task_id FROM schedule LIMIT 1 FOR UPDATE SKIP LOCKED;")
+        except self.error:
+            self.skip_locked = False
         return
 
     def __del__(self):
-        self.db.close()
+        while not self.pool.empty():
+            self.pool.get().close()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Run statements in a transaction on a pooled connection
+        Commits on success and rolls back if an exception is raised
+        """
+        conn = self.pool.get()
+        cur = conn.cursor()
+        try:
+            yield cur
+            conn.commit()
+        except:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            self.pool.put(conn)
 
     def add(self, task):
         """ Add a task to the schedule
         """
-        #Task_id is Find task_id, increment and add new task
-        #Must be atomic
+        with self.transaction() as cur:
+            self.insert(cur, task)
+        return task
+
+    def insert(self, cur, task):
         iteration = 0
         if 'iteration' in task:
             iteration = task['iteration']
         query = "INSERT INTO schedule (config, iteration, state, waiting_for) VALUES \
-             ('"+task['config']+"', "+str(iteration)+", 'init', '[]');"
-        self.cur.execute(query)
-        self.db.commit()
+             (%s, %s, 'init', '[]');"
+        cur.execute(query, (task['config'], iteration))
+        task['task_id'] = cur.lastrowid
+        return task
 
-        task_id = self.cur.lastrowid
-        task['task_id'] = task_id
+    def wait_for(self, task, new_tasks):
+        """Add new_tasks, and set task waiting for them
+        The new tasks and the edges are committed in a single transaction
+        """
+        try:
+            with self.transaction() as cur:
+                self.expand(cur, task, new_tasks)
+        except self.error:
+            print("Error: Could not commit transaction. Rolling back")
         return task
 
+    def expand(self, cur, task, new_tasks):
+        task['waiting_for'] = []
+        for t in new_tasks:
+            t['iteration'] = task['iteration']
+            self.insert(cur, t)
+            task['waiting_for'].append(t['task_id'])
+        task['state'] = 'waiting'
+        self.set_state(cur, task)
+
+    def add_batch(self, tasks):
+        """ Add a list of tasks to the schedule in a single transaction
+        """
+        with self.transaction() as cur:
+            for task in tasks:
+                self.insert(cur, task)
+        return tasks
+
     def update(self, task):
-        #TODO
+        try:
+            with self.transaction() as cur:
+                self.set_state(cur, task)
+        except self.error:
+            print("Error: Could not commit transaction. Rolling back")
+        return
+
+    def update_batch(self, tasks):
+        """Update a list of tasks in a single transaction
+        Tasks with new_tasks are set waiting for them (see wait_for)
+        """
+        try:
+            with self.transaction() as cur:
+                for task in tasks:
+                    if 'new_tasks' in task:
+                        self.expand(cur, task, task.pop('new_tasks'))
+                    else:
+                        self.set_state(cur, task)
+        except self.error:
+            print("Error: Could not commit transaction. Rolling back")
+        return
+
+    def set_state(self, cur, task):
         if 'waiting_for' not in task:
             task['waiting_for'] = []
-        query = "UPDATE schedule set state= '"+task['state']+"', waiting_for='"\
-            +json.dumps(task['waiting_for'])+"' WHERE task_id = "+str(task['task_id'])+";"
-        self.cur.execute(query)
-        self.db.commit()
-        return
+        if task['state'] == 'waiting':
+            self.add_edges(cur, task)
+        query = "UPDATE schedule set state = %s, waiting_for = %s WHERE task_id = %s;"
+        cur.execute(query, (task['state'], json.dumps(task['waiting_for']), task['task_id']))
+        if task['state'] == 'complete':
+            self.release(cur, task['task_id'])
+
+    def add_edges(self, cur, task):
+        """Store the edges of a waiting task and count the tasks it is
+        waiting for. The rows of these tasks are locked until commit, so
+        that none of them can be released before the edges are visible
+        """
+        task_id = task['task_id']
+        cur.execute("DELETE FROM dependency WHERE task_id = %s;", (task_id,))
+        pending = 0
+        deps = [int(dep) for dep in task['waiting_for']]
+        if len(deps) > 0:
+            cur.executemany("INSERT IGNORE INTO dependency (task_id, waiting_for) VALUES (%s, %s)",
+                [(task_id, dep) for dep in deps])
+            cur.execute("SELECT COUNT(*) FROM schedule WHERE released = 0 AND task_id IN ("\
+                +", ".join(["%s"]*len(deps))+") FOR UPDATE;", deps)
+            pending = int(cur.fetchone()[0])
+        cur.execute("UPDATE schedule set pending = %s WHERE task_id = %s;", (pending, task_id))
+
+    def release(self, cur, task_id):
+        """Mark a task as released and decrement the pending count of the
+        tasks waiting for it. Only the first release of a task has any effect
+        """
+        cur.execute("UPDATE schedule set released = 1 WHERE task_id = %s AND released = 0;",
+            (task_id,))
+        if cur.rowcount == 1:
+            cur.execute("UPDATE schedule s JOIN dependency d ON s.task_id = d.task_id \
+                set s.pending = s.pending - 1 WHERE d.waiting_for = %s;", (task_id,))
 
     def delete(self, task):
-        query = "DELETE FROM schedule WHERE task_id = "+str(task['task_id'])+";"
-        self.cur.execute(query)
-        self.db.commit()
+        task_id = task['task_id']
+        try:
+            with self.transaction() as cur:
+                #Tasks waiting for a deleted task are no longer blocked by it
+                self.release(cur, task_id)
+                cur.execute("DELETE FROM dependency WHERE task_id = %s OR waiting_for = %s;",
+                    (task_id, task_id))
+                cur.execute("DELETE FROM schedule WHERE task_id = %s;", (task_id,))
+        except self.error:
+            print("Error: Could not commit transaction. Rolling back")
         return task['task_id']
 
     def get(self, task):
-        query = "SELECT task_id, config, state FROM schedule WHERE task_id = "+str(task['task_id'])+";"
-        self.cur.execute(query)
-        row = self.cur.fetchone()
+        with self.transaction() as cur:
+            query = "SELECT task_id, config, state FROM schedule WHERE task_id = %s;"
+            cur.execute(query, (task['task_id'],))
+            row = cur.fetchone()
         task = {"task_id": row[0], "config": row[1], "state": row[2]}
         return task
 
     def get_next(self):
         """Get the next task to be scheduled
-        Gets the task with the least task_id (oldest task) whose state is 'init'
+        Gets the task with the least task_id (oldest task) whose state is 'init',
+        or whose state is 'waiting' and is not waiting for any incomplete task
+        The task is claimed atomically, so that concurrent schedulers never
+        start the same task: the row is locked with SKIP LOCKED (rows
+        locked by other schedulers are skipped rather than waited for), and
+        the state change is conditional on the state that was read
         """
-        self.db.autocommit(False)
-        self.cur.execute("START TRANSACTION;")
-        task = None
-        try:
-            query = "SELECT task_id, config, state, iteration,  waiting_for FROM schedule \
-                WHERE state='init' OR state='waiting';"
-            self.cur.execute(query)
-            rows = self.cur.fetchall()
-            if len(rows) == 0:
-                #No tasks to schedule
-                return None
-            tasks = []
-            for row in rows:
-                task = {"task_id": row[0], "config": row[1], "state": row[2],\
-                    "iteration": int(row[3]), "waiting_for": json.loads(row[4])}
-                tasks.append(task)
-            task = self.get_next_task(tasks)
-            if task == None:
-                self.db.rollback()
+        skip_locked = " FOR UPDATE SKIP LOCKED" if self.skip_locked else ""
+        query = "SELECT task_id, config, state, iteration,  waiting_for FROM schedule \
+            WHERE state IN ('init', 'waiting') AND pending <= 0 \
+            ORDER BY task_id LIMIT 1"+skip_locked+";"
+        while True:
+            try:
+                with self.transaction() as cur:
+                    cur.execute(query)
+                    row = cur.fetchone()
+                    if row is None:
+                        #No tasks to schedule
+                        return None
+                    task = {"task_id": row[0], "config": row[1], "state": row[2],\
+                        "iteration": int(row[3]), "waiting_for": json.loads(row[4])}
+                    state = task['state']
+                    self.start(task)
+                    cur.execute("UPDATE schedule set state = 'running', waiting_for = '[]', \
+                        iteration = %s WHERE task_id = %s AND state = %s;",
+                        (task['iteration'], task['task_id'], state))
+                    if cur.rowcount == 1:
+                        cur.execute("DELETE FROM dependency WHERE task_id = %s;",
+                            (task['task_id'],))
+                        return task
+                    #Claimed by another scheduler, try the next task
+            except self.error:
+                print("Error: Could not commit transaction. Rolling back")
                 return None
-                
-            query = "UPDATE schedule set state = 'running', waiting_for='[]', \
-                  iteration='"+str(task['iteration'])+"'  WHERE task_id = "+str(task['task_id'])+";"
-            
-            self.cur.execute(query)
-            self.db.commit()
-        except:
-            print("Error: Could not commit transaction. Rolling back")
-            self.db.rollback()
-        return task
-
 
     def get_all(self):
-        query = "SELECT task_id, config, state FROM schedule;"
-        self.cur.execute(query)
-        rows = self.cur.fetchall()
+        with self.transaction() as cur:
+            query = "SELECT task_id, config, state FROM schedule;"
+            cur.execute(query)
+            rows = cur.fetchall()
         tasks = []
         for row in rows:
             task = {"task_id": row[0], "config": row[1], "state": row[2]}
             tasks.append(task)
         return tasks
+
+class ScheduleSQLite(ScheduleDB):
+    """
+    Implements a schedule of tasks stored in an embedded SQLite database
+    Allows several scheduler processes on one host to share a durable
+    schedule without an external database service
+    The database is in WAL mode, so readers do not block the writer. Every
+    transaction takes the write lock when it begins (BEGIN IMMEDIATE), so
+    claiming a task is atomic across processes
+    """
+    def __init__(self, base_dir, sys_config):
+        import sqlite3
+        self.error = sqlite3.Error
+        path = "schedule.db"
+        pool_size = 4
+        if "sqlite" in sys_config:
+            if "path" in sys_config["sqlite"]:
+                path = sys_config["sqlite"]["path"]
+            if "pool_size" in sys_config["sqlite"]:
+                pool_size = int(sys_config["sqlite"]["pool_size"])
+        if not os.path.isabs(path):
+            path = base_dir + "/" + path
+        self.pool = queue.Queue()
+        for _ in range(pool_size):
+            conn = sqlite3.connect(path, timeout=30, isolation_level=None,
+                check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute("PRAGMA synchronous=NORMAL;")
+            self.pool.put(conn)
+
+        with self.transaction() as cur:
+            query = "CREATE TABLE IF NOT EXISTS schedule ( \
+                task_id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                config VARCHAR(1024) DEFAULT NULL, \
+                state VARCHAR(32) DEFAULT 'init', \
+                steps INTEGER DEFAULT 0, \
+                iteration INTEGER DEFAULT 0, \
+                waiting_for VARCHAR(1024) DEFAULT NULL, \
+                pending INTEGER DEFAULT 0, \
+                released INTEGER DEFAULT 0);"
+            cur.execute(query)
+            cur.execute("CREATE INDEX IF NOT EXISTS state_task ON schedule (state, task_id);")
+            query = "CREATE TABLE IF NOT EXISTS dependency ( \
+                task_id INTEGER NOT NULL, \
+                waiting_for INTEGER NOT NULL, \
+                PRIMARY KEY(task_id, waiting_for));"
+            cur.execute(query)
+            cur.execute("CREATE INDEX IF NOT EXISTS dependents ON dependency (waiting_for, task_id);")
+        #The write lock taken by BEGIN IMMEDIATE serializes claims
+        self.skip_locked = False
+        return
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Run statements in a transaction on a pooled connection
+        Commits on success and rolls back if an exception is raised
+        """
+        conn = self.pool.get()
+        cur = conn.cursor()
+        try:
+            cur.execute("BEGIN IMMEDIATE;")
+            yield SQLiteCursor(cur)
+            cur.execute("COMMIT;")
+        except:
+            if conn.in_transaction:
+                cur.execute("ROLLBACK;")
+            raise
+        finally:
+            cur.close()
+            self.pool.put(conn)
+
+    def add_edges(self, cur, task):
+        """Store the edges of a waiting task and count the tasks it is
+        waiting for
+        """
+        task_id = task['task_id']
+        cur.execute("DELETE FROM dependency WHERE task_id = %s;", (task_id,))
+        pending = 0
+        deps = [int(dep) for dep in task['waiting_for']]
+        if len(deps) > 0:
+            cur.executemany("INSERT OR IGNORE INTO dependency (task_id, waiting_for) VALUES (%s, %s)",
+                [(task_id, dep) for dep in deps])
+            cur.execute("SELECT COUNT(*) FROM schedule WHERE released = 0 AND task_id IN ("\
+                +", ".join(["%s"]*len(deps))+");", deps)
+            pending = int(cur.fetchone()[0])
+        cur.execute("UPDATE schedule set pending = %s WHERE task_id = %s;", (pending, task_id))
+
+    def release(self, cur, task_id):
+        """Mark a task as released and decrement the pending count of the
+        tasks waiting for it. Only the first release of a task has any effect
+        """
+        cur.execute("UPDATE schedule set released = 1 WHERE task_id = %s AND released = 0;",
+            (task_id,))
+        if cur.rowcount == 1:
+            cur.execute("UPDATE schedule set pending = pending - 1 WHERE task_id IN \
+                (SELECT task_id FROM dependency WHERE waiting_for = %s);", (task_id,))
+
+class SQLiteCursor():
+    """
+    Wraps a sqlite3 cursor to accept the format parameter style (%s) used
+    by the ScheduleDB statements
+    """
+    def __init__(self, cur):
+        self.cur = cur
+
+    def execute(self, query, args=()):
+        return self.cur.execute(query.replace("%s", "?"), args)
+
+    def executemany(self, query, args):
+        return self.cur.executemany(query.replace("%s", "?"), args)
+
+    def __getattr__(self, name):
+        return getattr(self.cur, name)
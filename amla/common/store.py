@@ -17,6 +17,13 @@ Base store class
 
 import os
 import json
+import errno
+import struct
+
+#Binary record logs: magic, header length, JSON header, then fixed size
+#records of an int64 step followed by one float32 per name in the header
+RECORDS_MAGIC = b"AMLAREC1"
+RECORDS_PREFIX = struct.Struct("<8sI")
 
 class Store:
     """
@@ -75,3 +82,159 @@ class Store:
         else:
             print("Error: Unsupported persistent store")
             exit(-1)
+
+    def delete(self, key):
+        """Delete a key, if it exists"""
+        if self.sys_config['persistent'] == 'filesystem':
+            key = self.base_dir + "/" + key
+            try:
+                os.remove(key)
+            except FileNotFoundError:
+                pass
+        else:
+            print("Error: Unsupported persistent store")
+            exit(-1)
+
+    def create_records(self, key, names):
+        """Create an empty binary record log for names
+        An existing log of that key is truncated
+        """
+        if self.sys_config['persistent'] == 'filesystem':
+            key = self.base_dir + "/" + key
+            self.make_dirs(key)
+            try:
+                with open(key, 'wb') as fwrite:
+                    self.write_records_header(fwrite, names)
+                return True
+            except IOError:
+                print("Error: Could not access key: " + key)
+                return None
+        else:
+            print("Error: Unsupported persistent store")
+            exit(-1)
+
+    def append_records(self, key, names, records):
+        """Append records to a binary record log
+        names: value names, written to the header when the log is created
+        records: list of (step, values), with one value per name
+        If the log was created for other names, it is moved to <key>.old
+        and a new log is started, so that records are never read back
+        under the wrong names. A partially written last record (e.g. of a
+        killed task) is dropped, so that appended records stay aligned
+        """
+        if self.sys_config['persistent'] == 'filesystem':
+            key = self.base_dir + "/" + key
+            self.make_dirs(key)
+            record = struct.Struct("<q" + "f" * len(names))
+            try:
+                if os.path.exists(key) and os.path.getsize(key) > 0:
+                    with open(key, 'rb') as fread:
+                        stored = self.read_records_header(fread)
+                    if stored != names:
+                        print("Warning: Record log " + key +
+                              " has other names, moving it to " + key + ".old")
+                        os.replace(key, key + ".old")
+                with open(key, 'a+b') as fwrite:
+                    size = os.fstat(fwrite.fileno()).st_size
+                    if size == 0:
+                        self.write_records_header(fwrite, names)
+                    else:
+                        fwrite.seek(0)
+                        self.read_records_header(fwrite)
+                        start = fwrite.tell()
+                        end = start + (size - start) // record.size * record.size
+                        if end != size:
+                            fwrite.truncate(end)
+                    for step, values in records:
+                        fwrite.write(record.pack(step, *values))
+                return True
+            except IOError:
+                print("Error: Could not access key: " + key)
+                return None
+        else:
+            print("Error: Unsupported persistent store")
+            exit(-1)
+
+    def make_dirs(self, path):
+        if not os.path.exists(os.path.dirname(path)):
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError as exc:
+                if exc.errno != errno.EEXIST:
+                   raise
+
+    def write_records_header(self, fwrite, names):
+        header = json.dumps({"names": names}).encode()
+        fwrite.write(RECORDS_PREFIX.pack(RECORDS_MAGIC, len(header)))
+        fwrite.write(header)
+
+    def read_records_header(self, fread):
+        """Read the names in the header of a record log
+        Returns None if the file is not a record log
+        """
+        prefix = fread.read(RECORDS_PREFIX.size)
+        if len(prefix) < RECORDS_PREFIX.size:
+            return None
+        magic, length = RECORDS_PREFIX.unpack(prefix)
+        if magic != RECORDS_MAGIC:
+            return None
+        return json.loads(fread.read(length).decode())["names"]
+
+    def read_last_record(self, key):
+        """Read the last complete record of a binary record log
+        Only the header and the last record are read
+        Returns (step, {name: value}), or None if there is no record
+        """
+        if self.sys_config['keyvalue'] == 'filesystem':
+            key = self.base_dir + "/" + key
+            try:
+                with open(key, 'rb') as fread:
+                    if os.fstat(fread.fileno()).st_size < RECORDS_PREFIX.size:
+                        return None
+                    names = self.read_records_header(fread)
+                    if names is None:
+                        print("Error: Not a record log: " + key)
+                        return None
+                    record = struct.Struct("<q" + "f" * len(names))
+                    start = fread.tell()
+                    #Ignore a partially written last record
+                    count = (os.fstat(fread.fileno()).st_size - start) // record.size
+                    if count == 0:
+                        return None
+                    fread.seek(start + (count - 1) * record.size)
+                    values = record.unpack(fread.read(record.size))
+                return values[0], dict(zip(names, values[1:]))
+            except IOError:
+                return None
+        else:
+            print("Error: Unsupported persistent store")
+            exit(-1)
+
+    def read_reverse(self, key, blocksize=65536):
+        """Iterate over the lines of a file, from the last to the first
+        The file is read backwards in blocks, so a reader that stops after
+        the latest lines does not read the whole file
+        """
+        if self.sys_config['keyvalue'] == 'filesystem':
+            key = self.base_dir + "/" + key
+            try:
+                fread = open(key, 'rb')
+            except IOError:
+                print("Error: Could not access key: " + key)
+                return
+            with fread:
+                position = fread.seek(0, os.SEEK_END)
+                remainder = b""
+                while position > 0:
+                    size = min(blocksize, position)
+                    position -= size
+                    fread.seek(position)
+                    lines = (fread.read(size) + remainder).split(b"\n")
+                    #The first line may continue in the previous block
+                    remainder = lines.pop(0)
+                    for line in reversed(lines):
+                        yield line.decode(errors='replace')
+                yield remainder.decode(errors='replace')
+        else:
+            print("Error: Unsupported persistent store")
+            exit(-1)
@@ -17,6 +17,11 @@ import os
 import signal
 import json
 import threading
+import traceback
+import subprocess
+import importlib
+import multiprocessing
+import concurrent.futures
 from subprocess import Popen
 from abc import ABCMeta
 from abc import abstractmethod
@@ -24,6 +29,85 @@ from abc import abstractmethod
 from common.store import Store
 from common.comm import Comm
 
+class BoundedExecutor:
+    """Thread pool with a bounded queue of pending work
+    Provides back-pressure: when max_workers + max_queue calls are pending,
+    submit blocks until one of them completes, or returns None if called
+    with block=False. Keeps counts of submitted, running, queued, completed
+    and rejected calls
+    """
+    def __init__(self, max_workers, max_queue):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self.capacity = threading.BoundedSemaphore(max_workers + max_queue)
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def submit(self, func, *args, block=True, timeout=None):
+        """Submit func(*args) to the pool
+        Returns a future, or None if the pool is full and block is False
+        (or timeout expired)
+        """
+        if not self.capacity.acquire(block, timeout):
+            with self.lock:
+                self.rejected += 1
+            return None
+        with self.lock:
+            self.submitted += 1
+        try:
+            return self.executor.submit(self.call, func, args)
+        except:
+            self.capacity.release()
+            raise
+
+    def call(self, func, args):
+        with self.lock:
+            self.running += 1
+        try:
+            return func(*args)
+        except Exception:
+            traceback.print_exc()
+            raise
+        finally:
+            with self.lock:
+                self.running -= 1
+                self.completed += 1
+            self.capacity.release()
+
+    def stats(self):
+        """Queue depth and throughput counters"""
+        with self.lock:
+            return {"workers": self.max_workers,
+                    "max_queue": self.max_queue,
+                    "running": self.running,
+                    "queued": self.submitted - self.completed - self.running,
+                    "submitted": self.submitted,
+                    "completed": self.completed,
+                    "rejected": self.rejected}
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+def fork_task(target, args, cpus=None, log=None, append=False):
+    """Entry point of a process forked from the fork server
+    target is "module:Class". The class is instantiated with args and run
+    """
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+        os.environ['OMP_NUM_THREADS'] = str(len(cpus))
+    if log:
+        flags = os.O_WRONLY | os.O_CREAT | (os.O_APPEND if append else os.O_TRUNC)
+        fd = os.open(log, flags, 0o644)
+        os.dup2(fd, 2)
+        os.close(fd)
+    module, name = target.split(":")
+    task = getattr(importlib.import_module(module), name)(*args)
+    task.run()
+
 class Task:
     """Base task class. All Tasks derive from this class
     Abstracts
@@ -34,6 +118,9 @@ class Task:
     - message sending/receive methods (REST client/?)
     """
     __metaclass__ = ABCMeta
+    executor = None
+    executor_lock = threading.Lock()
+    forkserver = None
     def __init__(self, base_dir):
         self.base_dir = base_dir
         self.sys_config_key = "configs/system.json"
@@ -43,7 +130,6 @@ class Task:
         self.children = {}
         self.name = ""
         self.app = None
-        self.threads = []
         self.host = ""
         self.port = 0
     def __del__(self):
@@ -74,20 +160,37 @@ class Task:
             self.main()
         elif self.sys_config['exec'][self.name] == "process":
             self.main()
+        elif self.sys_config['exec'][self.name] == "forkserver":
+            self.main()
         else:
             print("Error: Invalid execution mode specified in configuration")
             print("Should be either module, runtocompletion or service")
             exit(-1)
 
-    def start_thread(self, func, data=None):
-        """Start a thread within this task
+    def get_executor(self, min_workers=0):
+        """Get the thread pool shared by all tasks in this process
+        Sized by "executor": {"workers": .., "queue": ..} in the system config
+        """
+        with Task.executor_lock:
+            if Task.executor is None:
+                workers = 16
+                max_queue = 64
+                if "executor" in self.sys_config:
+                    if "workers" in self.sys_config["executor"]:
+                        workers = int(self.sys_config["executor"]["workers"])
+                    if "queue" in self.sys_config["executor"]:
+                        max_queue = int(self.sys_config["executor"]["queue"])
+                Task.executor = BoundedExecutor(max(workers, min_workers), max_queue)
+            return Task.executor
+
+    def start_thread(self, func, data=None, block=True):
+        """Run func in a thread of the shared executor
+        Returns a future, or None if the executor is full and block is False
         """
         sdata=None
         if data:
                 sdata = json.dumps(data)
-        thread = threading.Thread(target=func, args=[sdata])
-        self.threads.append(thread)
-        thread.start()
+        return self.get_executor().submit(func, sdata, block=block)
 
     def stop_thread(self):
         """Stop a running thread within this task
@@ -95,8 +198,10 @@ class Task:
         #TODO
         return True
 
-    def exec_process(self, process, args=None):
+    def exec_process(self, process, args=None, cpus=None):
         """Fork a new process to run a new task, blocking
+        If cpus is set, the process is pinned to those CPUs. TensorFlow sizes
+        its thread pools from the CPU affinity of the process
         """
         if process in self.sys_config['exes']:
             name = self.sys_config['exes'][process]
@@ -104,7 +209,68 @@ class Task:
             name = process
         sargs = " ".join(args) if args is not None else ""
         cmd = "python " + self.base_dir + "/" + name + " " + sargs
-        os.system(cmd)
+        env = None
+        if cpus:
+            #taskset sets the affinity in the child, so the scheduler does
+            #not run Python code between fork and exec (preexec_fn is not
+            #safe with the scheduler's threads)
+            cmd = "taskset -c " + ",".join(str(c) for c in sorted(cpus)) + " " + cmd
+            env = dict(os.environ)
+            env['OMP_NUM_THREADS'] = str(len(cpus))
+        subprocess.call(cmd, shell=True, env=env)
+
+    def get_forkserver(self):
+        """Get the multiprocessing context of the fork server
+        The fork server is started on first use and imports the modules
+        listed in "forkserver": {"preload": [..]} in the system config, so
+        processes forked from it do not pay the import cost again
+        """
+        with Task.executor_lock:
+            if Task.forkserver is None:
+                preload = ["tensorflow", "train_eval.tf.net"]
+                if "forkserver" in self.sys_config:
+                    if "preload" in self.sys_config["forkserver"]:
+                        preload = self.sys_config["forkserver"]["preload"]
+                ctx = multiprocessing.get_context('forkserver')
+                ctx.set_forkserver_preload(['__main__'] + preload)
+                Task.forkserver = ctx
+            return Task.forkserver
+
+    def exec_forked(self, target, args, cpus=None, log=None, append=False):
+        """Run a task in a process forked from the fork server, blocking
+        target is "module:Class", constructed with args. If cpus is set, the
+        process is pinned to those CPUs. If log is set, the stderr of the
+        process is redirected to that key
+        """
+        if log:
+            log = self.base_dir + "/" + log
+        ctx = self.get_forkserver()
+        proc = ctx.Process(target=fork_task,
+                           args=(target, args, cpus, log, append))
+        proc.start()
+        proc.join()
+        return proc.exitcode
+
+    def exec_library(self, target, args, log=None, append=False, **kwargs):
+        """Run a task in this process, blocking
+        target is "module:Class", constructed with args and kwargs. The task
+        object is returned so that its results can be read directly. If log
+        is set, the file of that key is opened and passed to the task as its
+        log keyword argument, so concurrent library tasks each write their
+        own log. Library tasks share the threads of the process (including
+        TensorFlow's thread pools), so they cannot be pinned to CPUs: the
+        CPUs of execution slots have no effect in this mode
+        """
+        module, name = target.split(":")
+        cls = getattr(importlib.import_module(module), name)
+        if not log:
+            task = cls(*args, **kwargs)
+            task.run()
+            return task
+        with open(self.base_dir + "/" + log, 'a' if append else 'w') as flog:
+            task = cls(*args, log=flog, **kwargs)
+            task.run()
+        return task
 
     def exec_process_async(self, process, args=None):
         """Fork a new process to run a new task, non blocking
@@ -23,18 +23,24 @@ import random
 import math
 import argparse
 
-parser = argparse.ArgumentParser()
-parser.add_argument('--base_dir', help='Base directory')
-parser.add_argument('--config', help='Configuration file key')
-parser.add_argument('--task', help='Task information')
-#parser.add_argument(
-#    '--lastconfig',
-#    help='Configuration file key from previous iteration')
-#parser.add_argument(
-#    '--lastresults',
-#    help='Results file key from previous iteration')
-args = parser.parse_args()
-sys.path.insert(0, args.base_dir)
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--base_dir', help='Base directory')
+    parser.add_argument('--config', help='Configuration file key')
+    parser.add_argument('--task', help='Task information')
+    #parser.add_argument(
+    #    '--lastconfig',
+    #    help='Configuration file key from previous iteration')
+    #parser.add_argument(
+    #    '--lastresults',
+    #    help='Results file key from previous iteration')
+    return parser.parse_args()
+
+#Arguments are only parsed when run as a process. When run as a library,
+#the scheduler has already set up the path
+if __name__ == '__main__':
+    args = parse_args()
+    sys.path.insert(0, args.base_dir)
 from common.task import Task
 
 
@@ -48,9 +54,16 @@ class Generate(Task):
         super().__init__(base_dir)
         self.name = 'generate'
         self.arch = []
+        # Index of each cell of the previous arch in the new arch
+        self.cellmap = {}
         self.task_config_key = config
         self.task_config = self.read(config)
-        self.task = json.loads(task)
+        #The task is a JSON string when run as a process, a dict when run
+        #as a library
+        if isinstance(task, str):
+            self.task = json.loads(task)
+        else:
+            self.task = dict(task)
         self.iteration = self.task['iteration']
         self.base_dir = base_dir
         self.get_task_params()
@@ -96,6 +109,12 @@ class Generate(Task):
         config["parameters"]["algorithm"] = "deterministic"
         config["parameters"]["mode"] = "train"
         del config["envelopenet"]
+        if "inherit_weights" in config["parameters"] and \
+                config["parameters"]["inherit_weights"] and self.cellmap:
+            # Train initializes the cells kept from the previous iteration
+            # from its checkpoint
+            config["inherit"] = {"iteration": self.iteration - 1,
+                                 "cells": self.cellmap}
         key = "results/" + self.arch_name + "/" + str(self.iteration) \
             + "/train/config/config.json"
         self.write(key, config)
@@ -118,12 +137,18 @@ class Generate(Task):
             prev_arch = self.read(prev_arch_key)["arch"]
             arch = self.construct(prev_arch, prev_results_key)
             self.save_config(arch)
-        if self.sys_config['exec']['scheduler'] == "service":
+        #As a library, the scheduler reads the results with get_results
+        if self.sys_config['exec']['scheduler'] == "service" and \
+                self.sys_config['exec'][self.name] != "library":
              self.put_results()
 
     def put_results(self):
-        task = self.task
+        task = self.get_results()
         task["op"] =  "POST"
+        self.send_request("scheduler", "tasks/update", task)
+
+    def get_results(self):
+        task = dict(self.task)
         if self.iteration == self.task_config["parameters"]["iterations"]:
             task['state'] = "complete"
         else:
@@ -142,7 +167,7 @@ class Generate(Task):
 
             task['state'] = "waiting"
             task['new_tasks'] = new_tasks
-        self.send_request("scheduler", "tasks/update", task)
+        return task
 
     def generate(self):
         """ Generate a network arch based on network config params: Used for
@@ -179,8 +204,6 @@ class Generate(Task):
         return narch
 
     def construct_envelopenet_bystages(self, samples):
-        lsamples = self.read(samples)
-        nsamples = lsamples.split('\n')
         worst_case = self.worst_case
         stages = []
         stage = []
@@ -208,8 +231,16 @@ class Generate(Task):
                 stage.append(layer)
                 lidx += 1
         stages.append(stage)
+        # Readings are needed only for the stages being constructed
+        cellnames = []
+        for stagenum, stage in enumerate(stages):
+            if self.construction[stagenum] and len(
+                    stage) <= self.max_layers_per_stage[stagenum]:
+                cellnames += stagecellnames[stagenum]
+        measurements = self.read_measurements(samples, cellnames)
         stagenum = 0
         narch = []
+        nidx = 1
         #print("Stage cellnames: " + str(stagecellnames))
         #print("Stage ssidx: " + str(ssidx))
         #print("Stages: " + str(stages))
@@ -217,7 +248,7 @@ class Generate(Task):
             if self.construction[stagenum] and len(
                     stage) <= self.max_layers_per_stage[stagenum]:
                 prune = self.select_prunable(
-                    stagecellnames[stagenum], nsamples, worst_case=worst_case)
+                    stagecellnames[stagenum], measurements, worst_case=worst_case)
                 #print("Stage: " + str(stage))
                 #print("Pruning " + str(prune))
                 nstage = self.prune_filters(ssidx[stagenum], stage, prune)
@@ -228,6 +259,14 @@ class Generate(Task):
             self.set_outputs(nstage, stagenum)
             if stagenum != len(stages) - 1:
                 nstage = self.add_widener(nstage)
+            # Pruning keeps the layers of the stage in place, a new cell is
+            # added at the end of the stage, before the widener
+            for lidx in range(len(stage)):
+                self.cellmap[str(ssidx[stagenum] + lidx)] = nidx + lidx
+            if stagenum != len(stages) - 1:
+                self.cellmap[str(ssidx[stagenum] + len(stage))] = \
+                    nidx + len(nstage) - 1
+            nidx += len(nstage)
             #print("New stage :" + str(nstage))
             narch += (nstage)
             stagenum += 1
@@ -237,16 +276,43 @@ class Generate(Task):
         #print("New arch :" + str(narch))
         return narch
 
+    def read_measurements(self, samples, cellnames):
+        """Get the last MeanSSS reading of each cell branch
+        Read from the binary stats log written next to the training log
+        (stats_format "binary"), else parsed from the training log. The
+        log is read backwards, until all of cellnames have a reading
+        """
+        stats_key = samples.rsplit("/", 1)[0] + "/stats.bin"
+        record = self.store.read_last_record(stats_key)
+        measurements = {}
+        if record is not None:
+            step, stats = record
+            for name in stats:
+                stat, filt = name.split(":", 1)
+                if stat == 'MeanSSS':
+                    measurements[filt] = stats[name]
+            return measurements
+        remaining = set(cellnames)
+        for sample in self.store.read_reverse(samples):
+            if 'MeanSSS' not in sample:
+                continue
+            # Skip a line still being written by the trainer
+            if not sample.rstrip().endswith(']'):
+                continue
+            sample = self.remove_logging(sample)
+            filt, value = self.get_filter_sample(sample)
+            # Use last reading
+            if filt not in measurements:
+                measurements[filt] = value
+            remaining.discard(filt)
+            if not remaining:
+                break
+        return measurements
+
     def remove_logging(self, line):
         line = re.sub("\d\d\d\d.*ops.cc:79\] ", "", line)
         return line
 
-    def filter_samples(self, samples):
-        #filter_string = 'Variance'
-        filter_string = 'MeanSSS'
-        filtered_log = [line for line in samples if filter_string in line]
-        return filtered_log
-
     def get_filter_sample(self, sample):
         fields = sample.split(":")
         filt = fields[1]
@@ -291,30 +357,18 @@ class Generate(Task):
                 layer["outputs"] = outputs
             lidx += 1
 
-    def select_prunable(self, stagecellnames, samples, worst_case=False):
-        samples = self.filter_samples(samples)
-        measurements = {}
-        for sample in samples:
-            if sample == '':
-                continue
-            sample = self.remove_logging(sample)
-            filt, value = self.get_filter_sample(sample)
-
-            # Prune only filters in this stage
-            if filt not in stagecellnames:
-                continue
-
-            if filt not in measurements:
-                measurements[filt] = []
-            measurements[filt].append(value)
-
+    def select_prunable(self, stagecellnames, measurements, worst_case=False):
+        """Select filters to prune
+        measurements: last reading of each filter (see read_measurements)
+        """
         #print("Stage cell names" + str(stagecellnames))
         #print("Filter in samples " + str(list(measurements.keys())))
         # Rank variances, select filters to prune
-        # Use last variance reading
+        # Prune only filters in this stage
         variances = {}
         for filt in measurements:
-            variances[filt] = measurements[filt][-1]
+            if filt in stagecellnames:
+                variances[filt] = measurements[filt]
 
         if worst_case:
             print("WARNING: -------GENERATING WORST CASE NET---------")
@@ -16,17 +16,26 @@
 
 import os
 import json
-from time import sleep
+import queue
+import asyncio
+import threading
+import functools
+import concurrent.futures
 from flask import Flask, request
 
 from common.task import Task
 from common.schedule import ScheduleMem
 from common.schedule import ScheduleDB
+from common.schedule import ScheduleSQLite
 
 
 def start_database_listener(args):
     scheduler.poll_tasks()
 
+def start_slot_task(args):
+    args = json.loads(args)
+    scheduler.run_slot_task(args["task"], args["slot"])
+
 class Scheduler(Task):
     """AMLA Scheduler
     Maintains a task list (schedule of tasks to be run)
@@ -48,11 +57,31 @@ class Scheduler(Task):
         self.stop = False
         if self.sys_config["schedule"] == "database":
             self.schedule = ScheduleDB(self.sys_config)
+            #Tasks may be added to the database by other schedulers, which
+            #cannot signal this one, so fall back to a periodic poll
+            self.poll_interval = 1
+        elif self.sys_config["schedule"] == "sqlite":
+            self.schedule = ScheduleSQLite(self.base_dir, self.sys_config)
+            self.poll_interval = 1
         else:
             self.schedule = ScheduleMem()
-
-        self.task_config_key = None
-        self.task_config = None
+            self.poll_interval = None
+        if "poll_interval" in self.sys_config:
+            self.poll_interval = self.sys_config["poll_interval"]
+        #Signalled when a task may have become schedulable
+        self.wakeup = threading.Condition()
+        self.notified = False
+        #Set when serving the API from an asyncio event loop
+        self.loop = None
+        self.event = None
+        #Checkpoints reported by persistent trainers, by task_id
+        self.evaluations = {}
+        self.evaluations_lock = threading.Lock()
+        self.init_slots()
+        #Slot tasks hold a worker (two, when training persistently) for as
+        #long as the task runs; leave room for the schedule poller and
+        #request handlers
+        self.executor = self.get_executor(2 * self.slots.qsize() + 4)
 
     def __del__(self):
         pass
@@ -68,26 +97,167 @@ class Scheduler(Task):
         #Start thread to poll database
         #Main thread listens for REST calls
         #Spawned thread polls schedule for new tasks to schedule
-        result = self.start_thread(start_database_listener)
         self.host = self.sys_config['host'][self.name]
         self.port = self.sys_config['port'][self.name]
+        if "server" in self.sys_config and self.sys_config["server"] == "asyncio":
+            asyncio.run(self.serve_async())
+            return
+        result = self.start_thread(start_database_listener)
         self.app.run(host=self.host, port=self.port)
 
+    async def serve_async(self):
+        """Serve the scheduler API from an asyncio event loop
+        Requests are parsed and answered on the event loop. Schedule calls
+        (database transactions with the "database" and "sqlite" schedules)
+        are run in a small pool of schedule threads, so a slow transaction
+        does not stall the loop. Tasks and other blocking work (process
+        launches) are run in the shared bounded thread pool, and also
+        update the schedule from there; the schedules are thread safe
+        """
+        from aiohttp import web
+        self.event = asyncio.Event()
+        self.loop = asyncio.get_running_loop()
+        workers = 4
+        if "database" in self.sys_config and "pool_size" in self.sys_config["database"]:
+            workers = int(self.sys_config["database"]["pool_size"])
+        self.schedule_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="schedule")
+        runner = web.AppRunner(create_async_app())
+        await runner.setup()
+        site = web.TCPSite(runner, self.host, self.port)
+        await site.start()
+        await self.dispatch_tasks()
+        #Keep serving requests after task dispatch is stopped
+        await self.loop.create_future()
+
+    async def dispatch_tasks(self):
+        """Event loop version of poll_tasks"""
+        while not self.stop:
+            try:
+                slot = self.slots.get_nowait()
+            except queue.Empty:
+                await self.wait_for_tasks_async()
+                continue
+            task = await self.run_schedule(self.get_task)
+            if task != None:
+                #The task is already claimed, so wait for room in the pool
+                #(off the event loop) rather than reject it
+                await self.loop.run_in_executor(None, functools.partial(
+                    self.executor.submit, self.run_slot_task, task, slot))
+            else:
+                self.slots.put(slot)
+                await self.wait_for_tasks_async()
+
+    async def wait_for_tasks_async(self):
+        try:
+            await asyncio.wait_for(self.event.wait(), self.poll_interval)
+        except asyncio.TimeoutError:
+            pass
+        self.event.clear()
+
+    async def run_schedule(self, func, *args):
+        """Run a call that reads or updates the schedule off the event loop"""
+        return await self.loop.run_in_executor(
+            self.schedule_executor, functools.partial(func, *args))
+
+    def run_blocking(self, func, *args):
+        """Run blocking work from a request handler in the thread pool
+        Returns an awaitable, or None if the pool is full
+        """
+        future = self.executor.submit(func, *args, block=False)
+        if future is None:
+            return None
+        return asyncio.wrap_future(future)
+
+    def init_slots(self):
+        """Create the pool of execution slots
+        Each slot runs one task at a time. When there is more than one slot
+        (or cpus_per_slot is set), each slot is assigned a disjoint set of
+        CPUs, so that concurrent train/evaluate processes do not
+        oversubscribe cores
+        """
+        nslots = 1
+        if "slots" in self.sys_config:
+            nslots = int(self.sys_config["slots"])
+        cpus = []
+        if hasattr(os, "sched_getaffinity"):
+            cpus = sorted(os.sched_getaffinity(0))
+        if not cpus:
+            #CPU affinity is not supported on this platform
+            cpus_per_slot = None
+        elif "cpus_per_slot" in self.sys_config:
+            cpus_per_slot = int(self.sys_config["cpus_per_slot"])
+        elif nslots > 1:
+            cpus_per_slot = max(1, len(cpus) // nslots)
+        else:
+            cpus_per_slot = None
+        if cpus_per_slot and "library" in [self.sys_config['exec'][name]
+                                           for name in ["train", "evaluate"]]:
+            print("Warning: Tasks run as a library are not pinned to the CPUs of their slot")
+        self.slots = queue.Queue()
+        self.slot_cpus = []
+        for slot in range(nslots):
+            slot_cpus = None
+            if cpus_per_slot:
+                slot_cpus = cpus[slot*cpus_per_slot:(slot+1)*cpus_per_slot]
+                if not slot_cpus:
+                    print("Warning: No CPUs left for slot "+str(slot)+", not pinning")
+                    slot_cpus = None
+            self.slot_cpus.append(slot_cpus)
+            self.slots.put(slot)
+
     def poll_tasks(self):
         while not self.stop:
+            #Wait for a free execution slot before pulling the next task
+            slot = self.slots.get()
             task = self.get_task();
             if task != None:
                 #print("Starting task"+str(task))
-                self.start_task(task)
+                self.start_thread(start_slot_task, {"task": task, "slot": slot})
             else:
                 #print("Nothing to schedule")
-                sleep(1)
+                self.slots.put(slot)
+                self.wait_for_tasks()
+
+    def run_slot_task(self, task, slot):
+        """Run a task pulled from the schedule and release its slot"""
+        try:
+            self.start_task(task, slot)
+        finally:
+            self.slots.put(slot)
+            if self.loop is not None:
+                #The dispatcher does not block on slots, wake it up
+                self.notify_tasks()
+
+    def wait_for_tasks(self):
+        """Block until a task may have become schedulable
+        Returns immediately if the schedule changed since the last wait
+        """
+        with self.wakeup:
+            if not self.notified and not self.stop:
+                self.wakeup.wait(self.poll_interval)
+            self.notified = False
+
+    def notify_tasks(self):
+        """Wake up the poll thread after a change to the schedule"""
+        with self.wakeup:
+            self.notified = True
+            self.wakeup.notify_all()
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.event.set)
 
     def add_task(self, task):
         """Add task to schedule"""
         task = self.schedule.add(task)
+        self.notify_tasks()
         return task
 
+    def add_tasks(self, tasks):
+        """Add a list of tasks to schedule"""
+        tasks = self.schedule.add_batch(tasks)
+        self.notify_tasks()
+        return tasks
+
     def get_task(self):
         """Get next task to schedule"""
         task = self.schedule.get_next()
@@ -96,6 +266,7 @@ class Scheduler(Task):
     def delete_task(self, task):
         """Delete task from schedule"""
         self.schedule.delete(task)
+        self.notify_tasks()
 
     def update_task(self, task):
         """Event based scheduling
@@ -106,14 +277,25 @@ class Scheduler(Task):
         #If the state of the task is waiting, 
         #then the task need more tasks to comple 
         if task['state'] == "waiting":
-            task['waiting_for'] = []
-            for t in task['new_tasks']:
-              t['iteration'] = task['iteration']
-              new_task  = self.schedule.add(t)
-              task['waiting_for'].append(new_task['task_id'])
-        if "new_tasks" in task:
+            new_tasks = task['new_tasks']
             del task["new_tasks"]
-        self.schedule.update(task)
+            self.schedule.wait_for(task, new_tasks)
+        else:
+            if "new_tasks" in task:
+                del task["new_tasks"]
+            self.schedule.update(task)
+        self.notify_tasks()
+        return 0
+
+    def update_tasks(self, tasks):
+        """Update a list of tasks
+        Same as update_task, but the schedule is updated in one batch
+        """
+        for task in tasks:
+            if task['state'] != "waiting" and "new_tasks" in task:
+                del task["new_tasks"]
+        self.schedule.update_batch(tasks)
+        self.notify_tasks()
         return 0
 
     def get_tasks(self):
@@ -121,44 +303,44 @@ class Scheduler(Task):
         tasks = self.schedule.get_all()
         return json.dumps(tasks)
 
-    def start_task(self, task):
+    def start_task(self, task, slot=None):
         """Start an AMLA task
         An AMLA task consists of train, evaluate and generate subtasks
         The task is specified through the task config file.
+        If the task was pulled from the schedule, it runs in an execution
+        slot and its subtasks are pinned to the CPUs of that slot
         """
 
         if 'config' not in task or task['config'] == '':
             #Start task may be called with just the task_id set, or with the 
             #full task structure
             task = self.schedule.get(task)
-        self.task_config_key = task['config']
-        self.task_config = self.read(self.task_config_key)
-        if self.task_config == None:
+        task_config = self.read(task['config'])
+        if task_config == None:
             print("Check config file and attempt again")
             return
-        self.arch_name = self.task_config["parameters"]["arch_name"]
-        mode = self.task_config["parameters"]["mode"]
-        steps = self.task_config["parameters"]["steps"]
-        iterations = self.task_config["parameters"]["iterations"]
-        eval_interval = self.task_config["parameters"]["eval_interval"]
+        cpus = None
+        if slot is not None:
+            cpus = self.slot_cpus[slot]
 
         task['state'] = 'running'
         self.schedule.update(task)
         if 'iteration' not in task:
             task['iteration'] = 0
 
-        if self.task_config["parameters"]["mode"] == "construct":
-                self.generate(task)
-        elif self.task_config["parameters"]["mode"] == "train":
-                self.train_eval(task)
+        if task_config["parameters"]["mode"] == "construct":
+                self.generate(task, task_config, cpus)
+        elif task_config["parameters"]["mode"] == "train":
+                self.train_eval(task, task_config, cpus)
         return 0
 
     def stop_task(self, task):
         self.stop = True
+        self.notify_tasks()
         return 0
 
 
-    def generate(self, task): #iteration):
+    def generate(self, task, task_config, cpus=None):
         """Start the Generate subtask
         The Generate subtask generates a new network, using results from
         previous iteration of train/evaluate
@@ -167,17 +349,17 @@ class Scheduler(Task):
         if self.sys_config['exec']['generate'] == "service":
             pass
         elif self.sys_config['exec']['generate'] == "library":
-            print("Error: Train and generate libraries not supported yet")
-            print("Set the mode to service in the system.json file ")
-            exit()
-            #generate = Generate(self.base_dir, self.task_config_key)
-            #generate.run()
+            print("Starting generation. Iteration: "+str(iteration))
+            generate = self.exec_library("generate.nac_en_cnn.generate:Generate",
+                [self.base_dir, task['config'], task])
+            print("Completed generation. Iteration: "+str(iteration))
+            self.update_task(generate.get_results())
         elif self.sys_config['exec']['generate'] == "process":
             args = [ '--base_dir='+ self.base_dir, \
-                '--config='+ self.task_config_key, \
+                '--config='+ task['config'], \
                 "--task='"+ json.dumps(task)+"'"]
             print("Starting generation. Iteration: "+str(iteration))
-            self.exec_process('generate/nac_en_cnn/generate.py', args) 
+            self.exec_process('generate/nac_en_cnn/generate.py', args, cpus)
             print("Completed generation. Iteration: "+str(iteration))
         elif self.sys_config['exec']['eval'] == "deployer":
             pass
@@ -186,90 +368,252 @@ class Scheduler(Task):
             print("Should be either library, process, service, or deployer")
             exit(-1)
 
-    def train_eval(self, task):
-        eval_interval = self.task_config["parameters"]["eval_interval"]
-        steps = self.task_config["parameters"]["steps"]
+    def train_eval(self, task, task_config, cpus=None):
+        if "persistent_train" in task_config["parameters"] and \
+                task_config["parameters"]["persistent_train"]:
+            self.persistent_train_eval(task, task_config, cpus)
+            return
+        eval_interval = task_config["parameters"]["eval_interval"]
+        steps = task_config["parameters"]["steps"]
+        if "pipeline_eval" in task_config["parameters"] and \
+                task_config["parameters"]["pipeline_eval"]:
+            self.pipelined_train_eval(task, task_config, cpus)
+            return
         for step in range(int(eval_interval), int(steps)+int(eval_interval),\
                  int(eval_interval)):
             task['steps'] = step
-            self.train(task)
-            self.eval(task)
-
-    def train(self, task): #steps, redirect='>>', iteration=0):
+            self.train(task, task_config, cpus)
+            if step >= int(steps) and self.speculative(task_config):
+                self.complete_early(task, task_config,
+                    self.split_cpus(task_config, cpus)[1])
+                return
+            self.eval(task, task_config, cpus)
+
+    def speculative(self, task_config):
+        """Whether tasks waiting for this one may start before its final
+        evaluation (parameters.speculative_generate)
+        In construct mode, the next iteration is generated from the training
+        results only
+        """
+        return "speculative_generate" in task_config["parameters"] and \
+            task_config["parameters"]["speculative_generate"]
+
+    def complete_early(self, task, task_config, eval_cpus=None):
+        """Complete a task once its training is done
+        Releases the tasks waiting for it (e.g. the next generate iteration)
+        and runs the final evaluation in the background, so that the
+        execution slot is free for them
+        """
+        self.update_task({"task_id": task['task_id'], "state": "complete"})
+        self.executor.submit(self.eval, dict(task), task_config, eval_cpus)
+
+    def pipelined_train_eval(self, task, task_config, cpus=None):
+        """Evaluate each training segment while the next one trains
+        The checkpoint at the end of segment k is evaluated concurrently
+        with training of segment k+1, on a separate share of the CPUs.
+        Training waits if evaluation falls more than one segment behind
+        """
+        eval_interval = int(task_config["parameters"]["eval_interval"])
+        steps = int(task_config["parameters"]["steps"])
+        train_cpus, eval_cpus = self.split_cpus(task_config, cpus)
+        evaluation = None
+        for step in range(eval_interval, steps+eval_interval, eval_interval):
+            task['steps'] = step
+            self.train(task, task_config, train_cpus)
+            if evaluation is not None:
+                evaluation.result()
+            if step >= steps and self.speculative(task_config):
+                self.complete_early(task, task_config, eval_cpus)
+                return
+            eval_task = dict(task)
+            eval_task['checkpoint'] = self.checkpoint_path(task, task_config)
+            evaluation = self.executor.submit(
+                self.eval, eval_task, task_config, eval_cpus)
+        if evaluation is not None:
+            evaluation.result()
+
+    def split_cpus(self, task_config, cpus=None):
+        """Split CPUs between training and an overlapping evaluation
+        parameters.eval_cpu_share is the fraction of CPUs given to
+        evaluation (default 0.25). Returns (train_cpus, eval_cpus). Where
+        CPU affinity is not supported, neither side is pinned
+        """
+        share = 0.25
+        if "eval_cpu_share" in task_config["parameters"]:
+            share = float(task_config["parameters"]["eval_cpu_share"])
+        if cpus:
+            pool = sorted(cpus)
+        elif hasattr(os, "sched_getaffinity"):
+            pool = sorted(os.sched_getaffinity(0))
+        else:
+            #CPU affinity is not supported on this platform
+            return None, None
+        if len(pool) < 2:
+            return cpus, cpus
+        neval = min(len(pool) - 1, max(1, int(round(len(pool) * share))))
+        return pool[neval:], pool[:neval]
+
+    def checkpoint_path(self, task, task_config):
+        """Path of the checkpoint saved at the end of a training segment"""
+        arch_name = task_config["parameters"]["arch_name"]
+        return self.base_dir + "/results/" + arch_name + "/" + \
+            str(task['iteration']) + "/train/model.ckpt-" + str(task['steps'])
+
+    def persistent_train_eval(self, task, task_config, cpus=None):
+        """Train all steps in one process, evaluating as it goes
+        The trainer keeps its graph, session and input pipeline for the
+        whole task. It saves a checkpoint every eval_interval steps and
+        reports it through the tasks/evaluate API. Reported checkpoints are
+        evaluated in order, in this thread, while training continues, each
+        side on its share of the CPUs (see split_cpus)
+        """
+        steps = int(task_config["parameters"]["steps"])
+        train_cpus, eval_cpus = self.split_cpus(task_config, cpus)
+        checkpoints = queue.Queue()
+        with self.evaluations_lock:
+            self.evaluations[task['task_id']] = checkpoints
+
+        train_task = dict(task)
+        train_task['steps'] = steps
+        def train():
+            try:
+                self.train(train_task, task_config, train_cpus)
+                if self.speculative(task_config):
+                    #Remaining checkpoints are still evaluated in this slot
+                    self.update_task({"task_id": task['task_id'], "state": "complete"})
+            finally:
+                checkpoints.put(None)
+        self.executor.submit(train)
+
+        evaluated = 0
+        try:
+            while True:
+                checkpoint = checkpoints.get()
+                if checkpoint is None:
+                    break
+                task['steps'] = checkpoint['steps']
+                task['checkpoint'] = checkpoint['checkpoint']
+                self.eval(task, task_config, eval_cpus)
+                evaluated = max(evaluated, checkpoint['steps'])
+        finally:
+            with self.evaluations_lock:
+                del self.evaluations[task['task_id']]
+        if 'checkpoint' in task:
+            del task['checkpoint']
+        if evaluated < steps:
+            #The trainer could not report its last checkpoint
+            task['steps'] = steps
+            self.eval(task, task_config, eval_cpus)
+
+    def evaluate_task(self, request):
+        """Queue a checkpoint reported by a persistent trainer for evaluation"""
+        with self.evaluations_lock:
+            if request['task_id'] not in self.evaluations:
+                print("Error: No persistent training for task "+str(request['task_id']))
+                return "Unknown task"
+            self.evaluations[request['task_id']].put(
+                {"steps": int(request['steps']), "checkpoint": request['checkpoint']})
+        return "OK"
+
+    def train(self, task, task_config, cpus=None):
         """Start the Train subtask
         The Train subtask trains a network generated by the Generate subtask
         """
-        if task['steps'] > self.task_config["parameters"]['eval_interval']:
+        if task['steps'] > task_config["parameters"]['eval_interval']:
             redirect = '>>'
         else:
             redirect = '>'
 
         #Use the config generated by the last iteration of generate
-        mode = self.task_config["parameters"]["mode"]
+        arch_name = task_config["parameters"]["arch_name"]
+        mode = task_config["parameters"]["mode"]
         if mode == "construct":
-            config_key = "results/"+self.arch_name+"/"+str(iteration)+"/config/config.json"
+            config_key = "results/"+arch_name+"/"+str(task['iteration'])+"/config/config.json"
         else: 
-            config_key = self.task_config_key
+            config_key = task['config']
         if self.sys_config['exec']['train'] == "service":
             print("Error: Train and generate services not supported yet")
             print("Set the mode to process in the system.json file ")
             exit()
         elif self.sys_config['exec']['train'] == "library":
-            print("Error: Train and generate libraries not supported yet")
-            print("Set the mode to process in the system.json file ")
-            exit()
-            #train = Train(self.base_dir, config_key)
-            #train.run()
+            print ("Training in progress. Iteration: "+str(task['iteration']))
+            results_key = "results/"+arch_name+"/"+str(task['iteration'])+"/train/results.train.log"
+            self.write(results_key, {})
+            train = self.exec_library("train_eval.tf.train:Train",
+                [self.base_dir, config_key, task],
+                results_key, redirect == '>>',
+                evaluate_callback=self.evaluate_task)
+            self.update_task(train.get_results())
         elif self.sys_config['exec']['train'] == "process":
             #TODO: Fix the result write method
             #Pass results file as arg to train
             #Fix tf results write
             print ("Training in progress. Iteration: "+str(task['iteration']))
-            results_key = "results/"+self.arch_name+"/"+str(task['iteration'])+"/train/results.train.log"
+            results_key = "results/"+arch_name+"/"+str(task['iteration'])+"/train/results.train.log"
             self.write(results_key, {})
             self.exec_process('train', ['--config='+\
                 config_key, '--base_dir='+self.base_dir,\
                 "--task='"+ json.dumps(task)+"'" \
-                , " 2"+redirect+results_key])
+                , " 2"+redirect+results_key], cpus)
+        elif self.sys_config['exec']['train'] == "forkserver":
+            print ("Training in progress. Iteration: "+str(task['iteration']))
+            results_key = "results/"+arch_name+"/"+str(task['iteration'])+"/train/results.train.log"
+            self.write(results_key, {})
+            self.exec_forked("train_eval.tf.train:Train",
+                [self.base_dir, config_key, json.dumps(task)],
+                cpus, results_key, redirect == '>>')
         elif self.sys_config['exec']['train'] == "deployer":
             #TODO: Kubeflow
             pass
         else:
             print("Error: Invalid execution mode specified in configuration")
-            print("Should be either library, process, service, or deployer")
+            print("Should be either library, process, forkserver, service, or deployer")
             exit(-1)
 
-    def eval(self, task):
+    def eval(self, task, task_config, cpus=None):
         """Start the Evaluate subtask
         The Evaluate subtask evaulates a network trained by the Train subtask
         """
-        if task['steps'] > self.task_config["parameters"]['eval_interval']:
+        if task['steps'] > task_config["parameters"]['eval_interval']:
             redirect = '>>'
         else:
             redirect = '>'
-        mode = self.task_config["parameters"]["mode"]
+        arch_name = task_config["parameters"]["arch_name"]
+        mode = task_config["parameters"]["mode"]
         if mode == "construct":
-            config_key = "results/"+self.arch_name+"/"+str(iteration)+"/config/config.json"
+            config_key = "results/"+arch_name+"/"+str(task['iteration'])+"/config/config.json"
         else: 
-            config_key = self.task_config_key
+            config_key = task['config']
         if self.sys_config['exec']['evaluate'] == "service":
             pass
         elif self.sys_config['exec']['evaluate'] == "library":
-            pass
+            print ("Evaluation in progress. Iteration: "+str(task['iteration']))
+            results_key = "results/"+arch_name+"/"+str(task['iteration'])+"/evaluate/results.eval.log"
+            self.write(results_key, {})
+            self.exec_library("train_eval.tf.evaluate:Evaluate",
+                [self.base_dir, config_key, task],
+                results_key, redirect == '>>')
         elif self.sys_config['exec']['evaluate'] == "process":
             print ("Evaluation in progress. Iteration: "+str(task['iteration']))
-            results_key = "results/"+self.arch_name+"/"+str(task['iteration'])+"/evaluate/results.eval.log"
+            results_key = "results/"+arch_name+"/"+str(task['iteration'])+"/evaluate/results.eval.log"
             self.write(results_key, {})
             self.exec_process('evaluate', ['--config='+\
                 config_key, '--base_dir='+self.base_dir,\
                 "--task='"+ json.dumps(task)+"'", \
-                "2"+redirect+results_key])
+                "2"+redirect+results_key], cpus)
+        elif self.sys_config['exec']['evaluate'] == "forkserver":
+            print ("Evaluation in progress. Iteration: "+str(task['iteration']))
+            results_key = "results/"+arch_name+"/"+str(task['iteration'])+"/evaluate/results.eval.log"
+            self.write(results_key, {})
+            self.exec_forked("train_eval.tf.evaluate:Evaluate",
+                [self.base_dir, config_key, json.dumps(task)],
+                cpus, results_key, redirect == '>>')
         elif self.sys_config['exec']['evaluate'] == "deployer":
             #TODO: Kubeflow
             pass
         else:
             print("Error: Invalid execution mode specified in configuration")
-            print("Should be either library, process, service or deployer")
+            print("Should be either library, process, forkserver, service or deployer")
             exit(-1)
 
 app = Flask("scheduler")
@@ -279,6 +623,11 @@ def add_task():
     config = json.loads(request.data.decode())
     return json.dumps(scheduler.add_task(config))
 
+@app.route('/api/v1.0/tasks/add_batch', methods=['POST'])
+def add_tasks():
+    tasks = json.loads(request.data.decode())["tasks"]
+    return json.dumps(scheduler.add_tasks(tasks))
+
 @app.route('/api/v1.0/tasks/delete', methods=['POST'])
 def delete_task():
     task = json.loads(request.data.decode())
@@ -291,6 +640,18 @@ def update_task():
     result = scheduler.update_task(task)
     return json.dumps({"result": str(result)})
 
+@app.route('/api/v1.0/tasks/update_batch', methods=['POST'])
+def update_tasks():
+    tasks = json.loads(request.data.decode())["tasks"]
+    result = scheduler.update_tasks(tasks)
+    return json.dumps({"result": str(result)})
+
+@app.route('/api/v1.0/tasks/evaluate', methods=['POST'])
+def evaluate_task():
+    request_data = json.loads(request.data.decode())
+    result = scheduler.evaluate_task(request_data)
+    return json.dumps({"result": str(result)})
+
 @app.route('/api/v1.0/tasks/get', methods=['GET'])
 def get_tasks():
     return json.dumps(scheduler.get_tasks())
@@ -298,13 +659,22 @@ def get_tasks():
 def start_scheduler_task(task):
     scheduler.start_task(json.loads(task))
 
+def update_scheduler_task(task):
+    scheduler.update_task(json.loads(task))
+
+def busy():
+    """Response when the thread pool has no room for more work"""
+    return json.dumps({"result": "Busy", "stats": scheduler.executor.stats()}), 503
+
 @app.route('/api/v1.0/tasks/start', methods=['POST'])
 def start_task():
     task = json.loads(request.data.decode())
     print("Scheduler task:"+str(task))
     print("Scheduler task:"+str(task['task_id']))
-    result = scheduler.start_thread(start_scheduler_task, task)
-    return json.dumps({"result": str(result)})
+    result = scheduler.start_thread(start_scheduler_task, task, block=False)
+    if result is None:
+        return busy()
+    return json.dumps({"result": "OK"})
 
 @app.route('/api/v1.0/tasks/stop', methods=['POST'])
 def stop_task():
@@ -321,11 +691,105 @@ def stop_scheduler():
     return json.dumps({"result": str(result)})
 
 
+@app.route('/api/v1.0/scheduler/stats', methods=['GET'])
+def get_stats():
+    return json.dumps(scheduler.executor.stats())
+
 @app.route('/api/v1.0/scheduler/results', methods=['POST'])
 def put_results():
     task = json.loads(request.data.decode())
-    result = scheduler.start_thread(put_results, task)
-    return json.dumps({"result": str(result)})
+    #Results are not rejected when the pool is full: the work that produced
+    #them would be lost. Wait for room in the queue instead
+    scheduler.start_thread(update_scheduler_task, task)
+    return json.dumps({"result": "OK"})
+
+def create_async_app():
+    """Scheduler API for the asyncio server
+    Same routes as the Flask app
+    """
+    from aiohttp import web
+
+    async def read(request):
+        return json.loads(await request.text())
+
+    def respond(data):
+        return web.Response(text=json.dumps(data))
+
+    def busy():
+        return web.Response(status=503, text=json.dumps(
+            {"result": "Busy", "stats": scheduler.executor.stats()}))
+
+    async def add_task(request):
+        return respond(await scheduler.run_schedule(
+            scheduler.add_task, await read(request)))
+
+    async def add_tasks(request):
+        return respond(await scheduler.run_schedule(
+            scheduler.add_tasks, (await read(request))["tasks"]))
+
+    async def delete_task(request):
+        await scheduler.run_schedule(scheduler.delete_task, await read(request))
+        return respond({"result": "OK"})
+
+    async def update_task(request):
+        result = await scheduler.run_schedule(
+            scheduler.update_task, await read(request))
+        return respond({"result": str(result)})
+
+    async def update_tasks(request):
+        result = await scheduler.run_schedule(
+            scheduler.update_tasks, (await read(request))["tasks"])
+        return respond({"result": str(result)})
+
+    async def evaluate_task(request):
+        result = scheduler.evaluate_task(await read(request))
+        return respond({"result": str(result)})
+
+    async def get_tasks(request):
+        return respond(await scheduler.run_schedule(scheduler.get_tasks))
+
+    async def start_task(request):
+        task = await read(request)
+        print("Scheduler task:"+str(task['task_id']))
+        if scheduler.run_blocking(scheduler.start_task, task) is None:
+            return busy()
+        return respond({"result": "OK"})
+
+    async def stop_task(request):
+        result = scheduler.stop_task(await read(request))
+        return respond({"result": str(result)})
+
+    async def stop_scheduler(request):
+        print("Stopping scheduler")
+        future = scheduler.run_blocking(scheduler.stop_scheduler)
+        if future is None:
+            return busy()
+        result = await future
+        return respond({"result": str(result)})
+
+    async def get_stats(request):
+        return respond(scheduler.executor.stats())
+
+    async def put_results(request):
+        result = await scheduler.run_schedule(
+            scheduler.update_task, await read(request))
+        return respond({"result": str(result)})
+
+    aapp = web.Application()
+    aapp.add_routes([
+        web.post('/api/v1.0/tasks/add', add_task),
+        web.post('/api/v1.0/tasks/add_batch', add_tasks),
+        web.post('/api/v1.0/tasks/delete', delete_task),
+        web.post('/api/v1.0/tasks/update', update_task),
+        web.post('/api/v1.0/tasks/update_batch', update_tasks),
+        web.post('/api/v1.0/tasks/evaluate', evaluate_task),
+        web.get('/api/v1.0/tasks/get', get_tasks),
+        web.post('/api/v1.0/tasks/start', start_task),
+        web.post('/api/v1.0/tasks/stop', stop_task),
+        web.post('/api/v1.0/scheduler/stop', stop_scheduler),
+        web.get('/api/v1.0/scheduler/stats', get_stats),
+        web.post('/api/v1.0/scheduler/results', put_results)])
+    return aapp
 
 if __name__ == '__main__':
     #parser = argparse.ArgumentParser()
@@ -0,0 +1,306 @@
+# Copyright 2018 Cisco Systems All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Resized dataset cache.
+
+A cache holds the images of a dataset decoded and resized for the
+image_size of a task, as uint8 in TFRecord shards, so training and
+evaluation neither read nor decode the full resolution sources. It is
+written by train_eval/tf/preprocess.py to
+<data_dir>/cache/<dataset>-<image_size>-<policy>, and used by tasks that
+set use_resized_cache.
+
+Training images are stored larger than image_size (see train_size), so
+that training from the cache keeps the random crops of the dataset, along
+with its flips and color distortions. CIFAR-10 training images are stored
+at their source resolution, and training from the cache is the same as
+cifar10_input.distorted_inputs. Evaluation images are stored at
+image_size. The policy says how images are brought to the stored size:
+  center: the central crop (for CIFAR-10 evaluation, the central
+    image_size pixels; for ImageNet, the central 87.5%, resized)
+  resize: the whole image, resized
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import math
+import shutil
+
+import tensorflow as tf
+
+from stubs.tf import cifar10_input
+from stubs.tf.imagenet.imagenet_data import ImagenetData
+import stubs.tf.imagenet.image_processing as imgnet
+
+POLICIES = ['center', 'resize']
+
+
+def cache_dir(data_dir, dataset, image_size, policy):
+    """Directory of the cache of a dataset at an image size and policy"""
+    return os.path.join(data_dir, 'cache',
+                        '%s-%d-%s' % (dataset, image_size, policy))
+
+
+def train_size(dataset, image_size):
+    """Size of the cached training images: the random crops of image_size
+    are taken from them
+    """
+    if dataset == 'cifar10':
+        return max(32, image_size)
+    # The crop covers the central 87.5% of the image, as for evaluation
+    return int(math.ceil(image_size / 0.875))
+
+
+def stored_size(dataset, subset, image_size):
+    """Size of the cached images of a subset"""
+    if subset == 'train':
+        return train_size(dataset, image_size)
+    return image_size
+
+
+def subsets(dataset):
+    """Training and evaluation subsets of a dataset"""
+    if dataset == 'cifar10':
+        return ['train', 'test']
+    return ['train', 'validation']
+
+
+def _source_examples(dataset, data_dir, subset, image_size, policy,
+                     num_parallel_calls):
+    """Dataset of (uint8 image, int32 label) pairs of a subset of the full
+    resolution dataset, cropped or resized as the policy says to the stored
+    size of the subset.
+    """
+    image_size = stored_size(dataset, subset, image_size)
+    if dataset == 'cifar10':
+        data_dir = os.path.join(data_dir, 'cifar-10-batches-bin')
+        if subset == 'train':
+            filenames = [os.path.join(data_dir, 'data_batch_%d.bin' % i)
+                         for i in range(1, 6)]
+        else:
+            filenames = [os.path.join(data_dir, 'test_batch.bin')]
+
+        def resize(uint8image, label):
+            if subset == 'train' or policy == 'center':
+                image = tf.image.resize_image_with_crop_or_pad(
+                    uint8image, image_size, image_size)
+            else:
+                image = tf.image.resize_images(
+                    tf.cast(uint8image, tf.float32), [image_size, image_size])
+                image = tf.cast(tf.round(image), tf.uint8)
+            return image, label
+
+        examples = cifar10_input._cifar10_dataset(filenames,
+                                                  num_parallel_calls)
+        return examples.map(resize, num_parallel_calls=num_parallel_calls)
+
+    def decode(example_serialized):
+        image_buffer, label_index, _, _ = imgnet.parse_example_proto(
+            example_serialized)
+        if policy == 'center':
+            image = imgnet.decode_and_eval_image(image_buffer, image_size,
+                                                 image_size)
+        else:
+            image = imgnet.decode_jpeg(image_buffer)
+            image = tf.image.resize_images(image, [image_size, image_size])
+        image = tf.image.convert_image_dtype(image, tf.uint8, saturate=True)
+        return image, tf.reshape(label_index, [])
+
+    data_files = ImagenetData(subset, data_dir).data_files()
+    examples = tf.data.TFRecordDataset(data_files)
+    return examples.map(decode, num_parallel_calls=num_parallel_calls)
+
+
+def write_cache(dataset, data_dir, image_size, policy, shard_size=10000,
+                num_parallel_calls=16):
+    """Write the cache of a dataset, if not present.
+
+    The shards are written to a temporary directory which is renamed when
+    complete, so the cache is only visible to tasks once whole.
+
+    Returns:
+      The cache directory.
+    """
+    if policy not in POLICIES:
+        raise ValueError('Unknown cache policy %s' % policy)
+    directory = cache_dir(data_dir, dataset, image_size, policy)
+    if tf.gfile.IsDirectory(directory):
+        print('Cache %s exists' % directory)
+        return directory
+    tmp_directory = '%s.%d.tmp' % (directory, os.getpid())
+    tf.gfile.MakeDirs(tmp_directory)
+    try:
+        for subset in subsets(dataset):
+            with tf.Graph().as_default():
+                examples = _source_examples(dataset, data_dir, subset,
+                                            image_size, policy,
+                                            num_parallel_calls)
+                images, labels = examples.batch(256).prefetch(
+                    2).make_one_shot_iterator().get_next()
+                with tf.Session() as sess:
+                    count = _write_shards(sess, images, labels, tmp_directory,
+                                          subset, shard_size)
+            print('Wrote %d %s examples' % (count, subset))
+        os.rename(tmp_directory, directory)
+    except:
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+        raise
+    return directory
+
+
+def _write_shards(sess, images, labels, directory, subset, shard_size):
+    """Write batches until the iterator is exhausted, shard_size examples
+    per shard
+    """
+    count = 0
+    writer = None
+    try:
+        while True:
+            try:
+                image_values, label_values = sess.run([images, labels])
+            except tf.errors.OutOfRangeError:
+                break
+            for image_value, label_value in zip(image_values, label_values):
+                if count % shard_size == 0:
+                    if writer:
+                        writer.close()
+                    writer = tf.python_io.TFRecordWriter(os.path.join(
+                        directory, '%s-%05d' % (subset, count // shard_size)))
+                example = tf.train.Example(features=tf.train.Features(feature={
+                    'image/raw': tf.train.Feature(
+                        bytes_list=tf.train.BytesList(
+                            value=[image_value.tobytes()])),
+                    'image/class/label': tf.train.Feature(
+                        int64_list=tf.train.Int64List(
+                            value=[int(label_value)]))}))
+                writer.write(example.SerializeToString())
+                count += 1
+    finally:
+        if writer:
+            writer.close()
+    return count
+
+
+def _cached_inputs(directory, dataset, subset, batch_size, image_size, train,
+                   num_parallel_calls, num_readers, shuffle_buffer):
+    """Batches of a subset of a cache, distorted if train is set.
+
+    Training images are randomly cropped to image_size, other images larger
+    than image_size are centrally cropped.
+    """
+    size = stored_size(dataset, subset, image_size)
+    data_files = tf.gfile.Glob(os.path.join(directory, '%s-*' % subset))
+    if not data_files:
+        raise ValueError('No %s files found in cache %s' % (subset, directory))
+
+    def parse(example_serialized):
+        features = tf.parse_single_example(example_serialized, {
+            'image/raw': tf.FixedLenFeature([], dtype=tf.string),
+            'image/class/label': tf.FixedLenFeature([], dtype=tf.int64)})
+        uint8image = tf.reshape(tf.decode_raw(features['image/raw'], tf.uint8),
+                                [size, size, 3])
+        label = tf.cast(features['image/class/label'], tf.int32)
+        if train:
+            uint8image = tf.random_crop(uint8image, [image_size, image_size, 3])
+        else:
+            uint8image = tf.image.resize_image_with_crop_or_pad(
+                uint8image, image_size, image_size)
+        if dataset == 'cifar10':
+            image = tf.cast(uint8image, tf.float32)
+            if train:
+                image = tf.image.random_flip_left_right(image)
+                image = tf.image.random_brightness(image, max_delta=63)
+                image = tf.image.random_contrast(image, lower=0.2, upper=1.8)
+            image = tf.image.per_image_standardization(image)
+        else:
+            image = tf.image.convert_image_dtype(uint8image, tf.float32)
+            if train:
+                image = tf.image.random_flip_left_right(image)
+                image = tf.cond(tf.random_uniform([]) < 0.5,
+                                lambda: imgnet.distort_color(image, 0),
+                                lambda: imgnet.distort_color(image, 1))
+            # Rescale to [-1,1] instead of [0, 1)
+            image = tf.multiply(tf.subtract(image, 0.5), 2.0)
+        image.set_shape([image_size, image_size, 3])
+        return image, label
+
+    files = tf.data.Dataset.from_tensor_slices(data_files)
+    if train:
+        files = files.shuffle(len(data_files))
+    files = files.repeat()
+    examples = files.apply(tf.contrib.data.parallel_interleave(
+        tf.data.TFRecordDataset, cycle_length=num_readers, sloppy=train))
+    if train:
+        examples = examples.shuffle(shuffle_buffer)
+    examples = examples.map(parse, num_parallel_calls=num_parallel_calls)
+    examples = examples.batch(batch_size).prefetch(2)
+    images, labels = examples.make_one_shot_iterator().get_next()
+    images.set_shape([batch_size, image_size, image_size, 3])
+    labels.set_shape([batch_size])
+
+    # Display the training images in the visualizer.
+    tf.summary.image('images', images)
+
+    return images, labels
+
+
+def distorted_inputs(directory, dataset, batch_size, image_size,
+                     num_parallel_calls=16, num_readers=4,
+                     shuffle_buffer=10000):
+    """Construct distorted input for training from a cache.
+
+    Args:
+      directory: Path to the cache.
+      dataset: Name of the dataset.
+      batch_size: Number of images per batch.
+      image_size: Size of the cropped images.
+      num_parallel_calls: Number of images distorted in parallel.
+      num_readers: Number of shards read in parallel.
+      shuffle_buffer: Number of examples shuffled.
+
+    Returns:
+      images: Images. 4D tensor of [batch_size, IMAGE_SIZE, IMAGE_SIZE, 3] size.
+      labels: Labels. 1D tensor of [batch_size] size.
+    """
+    with tf.name_scope('data_augmentation'):
+        return _cached_inputs(directory, dataset, 'train', batch_size,
+                              image_size, True, num_parallel_calls,
+                              num_readers, shuffle_buffer)
+
+
+def inputs(eval_data, directory, dataset, batch_size, image_size,
+           num_parallel_calls=16, num_readers=4):
+    """Construct input for evaluation from a cache.
+
+    Args:
+      eval_data: bool, indicating if one should use the train or eval data set.
+      directory: Path to the cache.
+      dataset: Name of the dataset.
+      batch_size: Number of images per batch.
+      image_size: Size of the cropped images.
+      num_parallel_calls: Number of images processed in parallel.
+      num_readers: Number of shards read in parallel.
+
+    Returns:
+      images: Images. 4D tensor of [batch_size, IMAGE_SIZE, IMAGE_SIZE, 3] size.
+      labels: Labels. 1D tensor of [batch_size] size.
+    """
+    subset = subsets(dataset)[1] if eval_data else 'train'
+    with tf.name_scope('input'):
+        return _cached_inputs(directory, dataset, subset, batch_size,
+                              image_size, False, num_parallel_calls,
+                              num_readers, None)
@@ -18,6 +18,15 @@ from stubs.tf.cell import Cell
 
 slim = tf.contrib.slim
 
+# Graph collections of envelope statistics exported by the trainer
+# ("binary" stats_format, or stats_interval set): names
+# ("Stat:Cellidx/branch") and the matching scalar tensors
+STATS_NAMES = "envelope_stats_names"
+STATS_VALUES = "envelope_stats"
+# Names of the statistics accumulator variables
+STATS_VARIABLES = ("samplecount", "sumsamples", "sumsquaredsamples",
+                   "channelmean", "channelmeansquare")
+
 class CellEnvelope(Cell):
     """ Defintion of an envelope cell"""
     def __init__(
@@ -76,7 +85,10 @@ class CellEnvelope(Cell):
                         net = slim.conv2d(
                             inputs, outchannels, [
                                 conv_h, conv_w], normalizer_fn=slim.batch_norm)
-                if self.log_stats:
+                if self.log_stats and (self.network.stats_format == "binary" or
+                                       self.network.stats_interval):
+                    net = self.collect_stats(net, branch, scope + "/" + branch)
+                elif self.log_stats:
                     mean, variance, msss = self.calc_stats(net, branch)
                     net = tf.Print(
                         net,
@@ -113,7 +125,49 @@ class CellEnvelope(Cell):
         #print(nscope, net, [net.get_shape().as_list()])
         return net, end_points
 
+    def collect_stats(self, net, branch, name):
+        """Add the statistics of a branch to the stats collections
+        The accumulators are updated every step. The statistics added to
+        the collections only read the accumulators, so the trainer can
+        fetch them at any interval
+        """
+        if self.network.stats == "welford":
+            updates = self.update_running_stats(net, branch)
+        else:
+            updates = self.update_stats(net, branch)
+        mean, variance, msss = self.read_stats(branch)
+        for stat, value in (("Mean", mean), ("Variance", variance),
+                            ("MeanSSS", msss)):
+            tf.add_to_collection(STATS_NAMES, stat + ":" + name)
+            tf.add_to_collection(STATS_VALUES, value)
+        with tf.control_dependencies(updates):
+            return tf.identity(net)
+
+    def read_stats(self, scope):
+        """Statistics of the accumulators, without updating them"""
+        with tf.variable_scope(scope, reuse=True):
+            if self.network.stats == "welford":
+                size = [self.output_per_filter]
+                channelmean = tf.get_variable("channelmean", size)
+                channelmeansquare = tf.get_variable("channelmeansquare", size)
+                return self.running_moments(
+                    channelmean.read_value(), channelmeansquare.read_value())
+            size = [
+                self.batchsize,
+                self.imagesize[0],
+                self.imagesize[1],
+                self.output_per_filter]
+            sumsquaredsamples = tf.get_variable("sumsquaredsamples", size)
+            sumsamples = tf.get_variable("sumsamples", size)
+            samplecount = tf.get_variable("samplecount", [1])
+            return self.moments(samplecount.read_value(),
+                                sumsamples.read_value(),
+                                sumsquaredsamples.read_value())
+
     def init_stats(self):
+        if self.network.stats == "welford":
+            self.init_running_stats()
+            return
         size = [
             self.batchsize,
             self.imagesize[0],
@@ -127,6 +181,15 @@ class CellEnvelope(Cell):
             "samplecount", [1], initializer=tf.zeros_initializer)
 
     def calc_stats(self, inputs, scope):
+        if self.network.stats == "welford":
+            return self.running_moments(
+                *self.update_running_stats(inputs, scope)[1:])
+        return self.moments(*self.update_stats(inputs, scope))
+
+    def update_stats(self, inputs, scope):
+        """Accumulate the statistics of a batch
+        Returns the updated samplecount, sumsamples and sumsquaredsamples
+        """
         with tf.variable_scope(scope, reuse=True):
             size = [
                 self.batchsize,
@@ -155,22 +218,69 @@ class CellEnvelope(Cell):
             tsumsquaredsamples = tf.add(
                 sumsquaredsamples, squared_sum_across_batch)
             sumsquaredsamples = sumsquaredsamples.assign(tsumsquaredsamples)
+            return samplecount, sumsamples, sumsquaredsamples
+
+    def moments(self, samplecount, sumsamples, sumsquaredsamples):
+        msss = (1 / samplecount) * (sumsquaredsamples)
+        msss = tf.reduce_mean(msss)
+        #msss = tf.Print(msss, [msss], message="MeanSSS:");
+
+        mean = (1 / samplecount) * (sumsamples)
+        # mean across all elements of the featuremap
+        mean = tf.reduce_mean(mean)
+        #mean = tf.Print(mean, [mean], message="Mean:");
+
+        variance = (1 / samplecount) * (sumsquaredsamples -
+                                        (tf.square(sumsamples) / samplecount))
+        # mean across all elements of the featuremap
+        variance = tf.reduce_mean(variance)
+        #variance = tf.Print(variance, [variance], message="Variance:");
+        return mean, variance, msss
+
+    def init_running_stats(self):
+        size = [self.output_per_filter]
+        samplecount = tf.contrib.framework.model_variable(
+            "samplecount", [1], initializer=tf.zeros_initializer)
+        channelmean = tf.contrib.framework.model_variable(
+            "channelmean", size, initializer=tf.zeros_initializer)
+        channelmeansquare = tf.contrib.framework.model_variable(
+            "channelmeansquare", size, initializer=tf.zeros_initializer)
 
-            msss = (1 / samplecount) * (sumsquaredsamples)
-            msss = tf.reduce_mean(msss)
-            #msss = tf.Print(msss, [msss], message="MeanSSS:");
-
-            mean = (1 / samplecount) * (sumsamples)
-            # mean across all elements of the featuremap
-            mean = tf.reduce_mean(mean)
-            #mean = tf.Print(mean, [mean], message="Mean:");
-
-            variance = (1 / samplecount) * (sumsquaredsamples -
-                                            (tf.square(sumsamples) / samplecount))
-            # mean across all elements of the featuremap
-            variance = tf.reduce_mean(variance)
-            #variance = tf.Print(variance, [variance], message="Variance:");
-            return mean, variance, msss
+    def update_running_stats(self, inputs, scope):
+        """Per channel version of update_stats
+        Keeps running (Welford) means over batches of each channel's value
+        and squared value, instead of sums for every element of the feature
+        map. Returns the updated samplecount, channelmean and
+        channelmeansquare
+        """
+        with tf.variable_scope(scope, reuse=True):
+            size = [self.output_per_filter]
+            samplecount = tf.get_variable("samplecount", [1])
+            channelmean = tf.get_variable("channelmean", size)
+            channelmeansquare = tf.get_variable("channelmeansquare", size)
+
+            # As in update_stats, sum across the N dimension, then average
+            # over the H and W dimensions
+            sum_across_batch = tf.reduce_mean(
+                tf.reduce_sum(inputs, axis=0), axis=[0, 1])
+            squared_sum_across_batch = tf.reduce_mean(
+                tf.reduce_sum(tf.square(inputs), axis=0), axis=[0, 1])
+
+            samplecount = samplecount.assign_add([1.0])
+            channelmean = channelmean.assign_add(
+                (sum_across_batch - channelmean) / samplecount)
+            channelmeansquare = channelmeansquare.assign_add(
+                (squared_sum_across_batch - channelmeansquare) / samplecount)
+            return samplecount, channelmean, channelmeansquare
+
+    def running_moments(self, channelmean, channelmeansquare):
+        """Mean and MeanSSS are the same as moments. Variance is computed
+        from the channel means, i.e. pooled over spatial positions
+        """
+        msss = tf.reduce_mean(channelmeansquare)
+        mean = tf.reduce_mean(channelmean)
+        variance = tf.reduce_mean(channelmeansquare - tf.square(channelmean))
+        return mean, variance, msss
 
     def init_entropy(self):
         bincount = tf.contrib.framework.model_variable(
@@ -23,7 +23,9 @@ from __future__ import division
 from __future__ import print_function
 
 import os
+import random
 
+import numpy as np
 from six.moves import xrange  # pylint: disable=redefined-builtin
 import tensorflow as tf
 
@@ -38,6 +40,9 @@ FLAGS = tf.app.flags.FLAGS
 NUM_EXAMPLES_PER_EPOCH_FOR_TRAIN = 50000
 NUM_EXAMPLES_PER_EPOCH_FOR_EVAL = 10000
 
+# Shuffled epochs stored in the memory mapped cache. Later epochs reuse them
+CACHE_EPOCHS = 64
+
 
 def read_cifar10(filename_queue):
     """Reads and parses examples from CIFAR10 data files.
@@ -266,3 +271,345 @@ def inputs(eval_data, data_dir, batch_size, image_size):
     return _generate_image_and_label_batch(float_image, read_input.label,
                                            min_queue_examples, batch_size,
                                            shuffle=False)
+
+
+def _cifar10_dataset(filenames, num_parallel_calls):
+    """Dataset of decoded CIFAR-10 examples, cached in memory.
+
+    Args:
+      filenames: CIFAR-10 binary files.
+      num_parallel_calls: Number of examples decoded in parallel.
+
+    Returns:
+      A Dataset of (uint8 image of [32, 32, 3], int32 label) pairs. The
+      files are read and decoded once; later epochs are served from memory.
+    """
+    label_bytes = 1  # 2 for CIFAR-100
+    height = 32
+    width = 32
+    depth = 3
+    image_bytes = height * width * depth
+    record_bytes = label_bytes + image_bytes
+
+    def decode(value):
+        record = tf.decode_raw(value, tf.uint8)
+        label = tf.cast(record[0], tf.int32)
+        # [depth * height * width] to [height, width, depth]
+        depth_major = tf.reshape(record[label_bytes:record_bytes],
+                                 [depth, height, width])
+        return tf.transpose(depth_major, [1, 2, 0]), label
+
+    dataset = tf.data.FixedLengthRecordDataset(filenames, record_bytes)
+    dataset = dataset.map(decode, num_parallel_calls=num_parallel_calls)
+    return dataset.cache()
+
+
+def _dataset_batch(dataset, batch_size, height, width):
+    """Batch, prefetch and return the next (images, labels) of a dataset.
+
+    The dataset repeats, so every batch is full and the batch dimension can
+    be set statically.
+    """
+    return _prefetched_batch(dataset.batch(batch_size), batch_size,
+                             height, width)
+
+
+def _prefetched_batch(dataset, batch_size, height, width):
+    """Prefetch and return the next (images, labels) of a batched dataset."""
+    images, labels = dataset.prefetch(2).make_one_shot_iterator().get_next()
+    images.set_shape([batch_size, height, width, 3])
+    labels.set_shape([batch_size])
+
+    # Display the training images in the visualizer.
+    tf.summary.image('images', images)
+
+    return images, labels
+
+
+def dataset_distorted_inputs(data_dir, batch_size, image_size,
+                             num_parallel_calls=16):
+    """Construct distorted input for CIFAR training using tf.data.
+
+    Same distortions as distorted_inputs. The decoded images are cached in
+    memory and the distortions are applied by a parallel map, so training
+    starts without filling a shuffle queue.
+
+    Args:
+      data_dir: Path to the CIFAR-10 data directory.
+      batch_size: Number of images per batch.
+      image_size: Size of the cropped images.
+      num_parallel_calls: Number of images distorted in parallel.
+
+    Returns:
+      images: Images. 4D tensor of [batch_size, IMAGE_SIZE, IMAGE_SIZE, 3] size.
+      labels: Labels. 1D tensor of [batch_size] size.
+    """
+    filenames = [os.path.join(data_dir, 'data_batch_%d.bin' % i)
+                 for i in xrange(1, 6)]
+    for f in filenames:
+        if not tf.gfile.Exists(f):
+            raise ValueError('Failed to find file: ' + f)
+
+    height = image_size
+    width = image_size
+
+    def distort(uint8image, label):
+        reshaped_image = tf.cast(uint8image, tf.float32)
+        distorted_image = tf.random_crop(reshaped_image, [height, width, 3])
+        distorted_image = tf.image.random_flip_left_right(distorted_image)
+        distorted_image = tf.image.random_brightness(distorted_image,
+                                                     max_delta=63)
+        distorted_image = tf.image.random_contrast(distorted_image,
+                                                   lower=0.2, upper=1.8)
+        float_image = tf.image.per_image_standardization(distorted_image)
+        float_image.set_shape([height, width, 3])
+        return float_image, label
+
+    with tf.name_scope('data_augmentation'):
+        # Shuffle as much as the queue based pipeline keeps in its queue
+        min_fraction_of_examples_in_queue = 0.4
+        min_queue_examples = int(NUM_EXAMPLES_PER_EPOCH_FOR_TRAIN *
+                                 min_fraction_of_examples_in_queue)
+        dataset = _cifar10_dataset(filenames, num_parallel_calls)
+        dataset = dataset.shuffle(min_queue_examples).repeat()
+        dataset = dataset.map(distort, num_parallel_calls=num_parallel_calls)
+        return _dataset_batch(dataset, batch_size, height, width)
+
+
+def dataset_inputs(eval_data, data_dir, batch_size, image_size,
+                   num_parallel_calls=16):
+    """Construct input for CIFAR evaluation using tf.data.
+
+    Args:
+      eval_data: bool, indicating if one should use the train or eval data set.
+      data_dir: Path to the CIFAR-10 data directory.
+      batch_size: Number of images per batch.
+      image_size: Size of the cropped images.
+      num_parallel_calls: Number of images processed in parallel.
+
+    Returns:
+      images: Images. 4D tensor of [batch_size, IMAGE_SIZE, IMAGE_SIZE, 3] size.
+      labels: Labels. 1D tensor of [batch_size] size.
+    """
+    if not eval_data:
+        filenames = [os.path.join(data_dir, 'data_batch_%d.bin' % i)
+                     for i in xrange(1, 6)]
+    else:
+        filenames = [os.path.join(data_dir, 'test_batch.bin')]
+
+    for f in filenames:
+        if not tf.gfile.Exists(f):
+            raise ValueError('Failed to find file: ' + f)
+
+    height = image_size
+    width = image_size
+
+    def crop(uint8image, label):
+        reshaped_image = tf.cast(uint8image, tf.float32)
+        # Crop the central [height, width] of the image.
+        resized_image = tf.image.resize_image_with_crop_or_pad(reshaped_image,
+                                                               height, width)
+        float_image = tf.image.per_image_standardization(resized_image)
+        float_image.set_shape([height, width, 3])
+        return float_image, label
+
+    with tf.name_scope('input'):
+        dataset = _cifar10_dataset(filenames, num_parallel_calls).repeat()
+        dataset = dataset.map(crop, num_parallel_calls=num_parallel_calls)
+        return _dataset_batch(dataset, batch_size, height, width)
+
+
+def _save_atomic(path, array):
+    """Write an array to a .npy file, visible to readers only when complete"""
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'wb') as fwrite:
+        np.save(fwrite, array)
+    os.rename(tmp_path, path)
+
+
+def _cache_files(cache_dir, split):
+    return [os.path.join(cache_dir, '%s_%s.npy' % (split, name))
+            for name in ('images', 'labels', 'permutations')]
+
+
+def maybe_build_cache(data_dir, cache_dir):
+    """Decode the CIFAR-10 binaries into a memory mapped cache.
+
+    For each split, writes uint8 images of [N, 32, 32, 3], uint8 labels of
+    [N] and CACHE_EPOCHS shuffle permutations of [CACHE_EPOCHS, N] as .npy
+    files, which training and evaluation processes map read-only. Processes
+    on a host then share one copy of the decoded data through the page
+    cache. Files are written atomically, so concurrent builders are safe.
+
+    Args:
+      data_dir: Path to the CIFAR-10 data directory.
+      cache_dir: Path to the cache directory.
+    """
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+    splits = {'train': ['data_batch_%d.bin' % i for i in xrange(1, 6)],
+              'test': ['test_batch.bin']}
+    for split in splits:
+        images_file, labels_file, permutations_file = _cache_files(
+            cache_dir, split)
+        if os.path.exists(permutations_file):
+            continue
+        print('Building CIFAR-10 %s cache in %s' % (split, cache_dir))
+        records = np.concatenate(
+            [np.fromfile(os.path.join(data_dir, f), dtype=np.uint8)
+             for f in splits[split]]).reshape(-1, 1 + 32 * 32 * 3)
+        labels = records[:, 0].copy()
+        # [depth, height, width] to [height, width, depth]
+        images = records[:, 1:].reshape(-1, 3, 32, 32).transpose(0, 2, 3, 1)
+        rng = np.random.RandomState(0)
+        permutations = np.stack(
+            [rng.permutation(len(labels)) for _ in xrange(CACHE_EPOCHS)]
+        ).astype(np.int32)
+        _save_atomic(images_file, np.ascontiguousarray(images))
+        _save_atomic(labels_file, labels)
+        # Written last: marks the split as complete
+        _save_atomic(permutations_file, permutations)
+
+
+def _mmap_batches(cache_dir, split, batch_size, shuffle):
+    """Dataset of uint8 batches gathered from the memory mapped cache.
+
+    Batches follow the cached permutations when shuffle is set, starting
+    at a random epoch, else the order of the split.
+    """
+    images_file, labels_file, permutations_file = _cache_files(cache_dir, split)
+    images = np.load(images_file, mmap_mode='r')
+    labels = np.load(labels_file, mmap_mode='r')
+    permutations = np.load(permutations_file, mmap_mode='r')
+    num_examples = len(labels)
+    first = 0
+    if shuffle:
+        first = random.randrange(len(permutations)) * num_examples
+
+    def gather(batch):
+        offsets = first + batch * batch_size + np.arange(batch_size)
+        if shuffle:
+            epochs = (offsets // num_examples) % len(permutations)
+            indices = permutations[epochs, offsets % num_examples]
+        else:
+            indices = offsets % num_examples
+        indices = np.sort(indices)
+        return images[indices], labels[indices].astype(np.int32)
+
+    def read(batch):
+        uint8images, batch_labels = tf.py_func(
+            gather, [batch], [tf.uint8, tf.int32], stateful=False)
+        uint8images.set_shape([batch_size, 32, 32, 3])
+        batch_labels.set_shape([batch_size])
+        return uint8images, batch_labels
+
+    return tf.data.Dataset.range(np.iinfo(np.int64).max).map(read)
+
+
+def mmap_distorted_inputs(cache_dir, batch_size, image_size,
+                          num_parallel_calls=16):
+    """Construct distorted input for CIFAR training from the mmap cache.
+
+    Same distortions as distorted_inputs, applied to each batch by a
+    parallel map. No shuffle buffer needs to be filled.
+
+    Args:
+      cache_dir: Path to the cache built by maybe_build_cache.
+      batch_size: Number of images per batch.
+      image_size: Size of the cropped images.
+      num_parallel_calls: Number of batches processed in parallel.
+
+    Returns:
+      images: Images. 4D tensor of [batch_size, IMAGE_SIZE, IMAGE_SIZE, 3] size.
+      labels: Labels. 1D tensor of [batch_size] size.
+    """
+    height = image_size
+    width = image_size
+
+    def distort(uint8image):
+        reshaped_image = tf.cast(uint8image, tf.float32)
+        distorted_image = tf.random_crop(reshaped_image, [height, width, 3])
+        distorted_image = tf.image.random_flip_left_right(distorted_image)
+        distorted_image = tf.image.random_brightness(distorted_image,
+                                                     max_delta=63)
+        distorted_image = tf.image.random_contrast(distorted_image,
+                                                   lower=0.2, upper=1.8)
+        return tf.image.per_image_standardization(distorted_image)
+
+    def distort_batch(uint8images, labels):
+        return tf.map_fn(distort, uint8images, dtype=tf.float32), labels
+
+    with tf.name_scope('data_augmentation'):
+        dataset = _mmap_batches(cache_dir, 'train', batch_size, shuffle=True)
+        dataset = dataset.map(distort_batch,
+                              num_parallel_calls=num_parallel_calls)
+        return _prefetched_batch(dataset, batch_size, height, width)
+
+
+def mmap_inputs(eval_data, cache_dir, batch_size, image_size,
+                num_parallel_calls=16):
+    """Construct input for CIFAR evaluation from the mmap cache.
+
+    Args:
+      eval_data: bool, indicating if one should use the train or eval data set.
+      cache_dir: Path to the cache built by maybe_build_cache.
+      batch_size: Number of images per batch.
+      image_size: Size of the cropped images.
+      num_parallel_calls: Number of batches processed in parallel.
+
+    Returns:
+      images: Images. 4D tensor of [batch_size, IMAGE_SIZE, IMAGE_SIZE, 3] size.
+      labels: Labels. 1D tensor of [batch_size] size.
+    """
+    height = image_size
+    width = image_size
+
+    def crop_batch(uint8images, labels):
+        reshaped_images = tf.cast(uint8images, tf.float32)
+        # Crop the central [height, width] of the images.
+        resized_images = tf.image.resize_image_with_crop_or_pad(
+            reshaped_images, height, width)
+        float_images = tf.map_fn(tf.image.per_image_standardization,
+                                 resized_images)
+        return float_images, labels
+
+    split = 'test' if eval_data else 'train'
+    with tf.name_scope('input'):
+        dataset = _mmap_batches(cache_dir, split, batch_size, shuffle=False)
+        dataset = dataset.map(crop_batch,
+                              num_parallel_calls=num_parallel_calls)
+        return _prefetched_batch(dataset, batch_size, height, width)
+
+
+def server_distorted_inputs(cache_dir, batch_size, image_size):
+    """Construct distorted input for CIFAR training from the data server.
+
+    The data server (data_server.py) distorts batches of the memory mapped
+    cache once for all the trainers of a host. It is started if none is
+    running.
+
+    Args:
+      cache_dir: Path to the cache built by maybe_build_cache.
+      batch_size: Number of images per batch.
+      image_size: Size of the cropped images.
+
+    Returns:
+      images: Images. 4D tensor of [batch_size, IMAGE_SIZE, IMAGE_SIZE, 3] size.
+      labels: Labels. 1D tensor of [batch_size] size.
+    """
+    from stubs.tf import data_server
+
+    client = data_server.DataClient(*_cache_files(cache_dir, 'train'),
+                                    batch_size=batch_size,
+                                    image_size=image_size)
+
+    def fetch(_):
+        return client.next_batch()
+
+    def read(step):
+        images, labels = tf.py_func(fetch, [step], [tf.float32, tf.int32])
+        return images, labels
+
+    with tf.name_scope('data_augmentation'):
+        dataset = tf.data.Dataset.range(np.iinfo(np.int64).max).map(read)
+        return _prefetched_batch(dataset, batch_size, image_size, image_size)
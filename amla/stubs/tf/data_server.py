@@ -0,0 +1,305 @@
+# Copyright 2018 Cisco Systems All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Data server: augments CIFAR-10 batches once per host for all trainers.
+
+The server reads the memory mapped cache built by
+cifar10_input.maybe_build_cache, applies the distortions of
+cifar10_input.distorted_inputs to whole batches with numpy and publishes
+them in a ring of slots in shared memory. Trainers connect over a Unix
+socket, ask for the next batch and copy it out of its slot. Every batch is
+served to every connected trainer, so the augmentation cost is paid once,
+not once per trainer. A trainer that falls more than a ring behind skips to
+the oldest batch still available.
+
+The server is started by the first DataClient that finds none running, and
+exits when no trainer has been connected for a while. It does not import
+TensorFlow.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import sys
+import time
+import fcntl
+import hashlib
+import argparse
+import threading
+import subprocess
+from multiprocessing import connection
+from multiprocessing import resource_tracker
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+def server_address(images, batch_size, image_size):
+    """Address of the server of a cache and batch shape.
+
+    An abstract Unix socket: it disappears with the server, so no stale
+    socket file is left behind if the server dies.
+    """
+    key = '%s:%d:%d' % (os.path.abspath(images), batch_size, image_size)
+    return '\0amla-data-server-' + hashlib.md5(key.encode()).hexdigest()
+
+
+def slot_arrays(buf, slots, batch_size, image_size):
+    """Views of the images and labels of each slot of the ring."""
+    images_shape = (slots, batch_size, image_size, image_size, 3)
+    images_bytes = int(np.prod(images_shape)) * 4
+    images = np.ndarray(images_shape, dtype=np.float32, buffer=buf)
+    labels = np.ndarray((slots, batch_size), dtype=np.int32, buffer=buf,
+                        offset=images_bytes)
+    return images, labels
+
+
+def ring_bytes(slots, batch_size, image_size):
+    return slots * batch_size * (image_size * image_size * 3 * 4 + 4)
+
+
+class DataServer:
+    """Produces augmented batches into a shared memory ring.
+
+    Batches are numbered by a sequence number; batch seq is in slot
+    seq % slots. The batch being written and the batches still held by
+    trainers are never handed out or overwritten. The producer keeps
+    prefetch batches ahead of the fastest trainer.
+    """
+    def __init__(self, images, labels, permutations, batch_size, image_size,
+                 slots=8, idle=60):
+        self.images = np.load(images, mmap_mode='r')
+        self.labels = np.load(labels, mmap_mode='r')
+        self.permutations = np.load(permutations, mmap_mode='r')
+        self.batch_size = batch_size
+        self.image_size = image_size
+        self.slots = slots
+        self.prefetch = max(1, slots // 2)
+        self.idle = idle
+        self.address = server_address(images, batch_size, image_size)
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=ring_bytes(slots, batch_size, image_size))
+        self.ring_images, self.ring_labels = slot_arrays(
+            self.shm.buf, slots, batch_size, image_size)
+        self.rng = np.random.RandomState()
+        self.cond = threading.Condition()
+        self.produced = 0
+        self.held = [0] * slots
+        self.cursors = {}
+        self.last_client = time.time()
+        self.offset = self.rng.randint(len(self.permutations)) * len(self.labels)
+
+    def augment(self, uint8images, out):
+        """Distort a batch of uint8 images [B, 32, 32, 3] into out.
+
+        Random crop, flip, brightness and contrast followed by per image
+        standardization, as in cifar10_input.distorted_inputs.
+        """
+        batch = len(uint8images)
+        size = self.image_size
+        height, width = uint8images.shape[1:3]
+        ys = self.rng.randint(0, height - size + 1, batch)
+        xs = self.rng.randint(0, width - size + 1, batch)
+        rows = ys[:, None] + np.arange(size)
+        cols = xs[:, None] + np.arange(size)
+        flip = self.rng.rand(batch) < 0.5
+        cols[flip] = cols[flip, ::-1]
+        crops = uint8images[np.arange(batch)[:, None, None],
+                            rows[:, :, None], cols[:, None, :]]
+        images = crops.astype(np.float32)
+        images += self.rng.uniform(-63, 63, (batch, 1, 1, 1)).astype(np.float32)
+        factor = self.rng.uniform(0.2, 1.8, (batch, 1, 1, 1)).astype(np.float32)
+        mean = images.mean(axis=(1, 2), keepdims=True)
+        images -= mean
+        images *= factor
+        images += mean
+        mean = images.mean(axis=(1, 2, 3), keepdims=True)
+        std = images.std(axis=(1, 2, 3), keepdims=True)
+        adjusted_std = np.maximum(std, 1.0 / np.sqrt(images[0].size))
+        np.divide(images - mean, adjusted_std, out=out)
+
+    def produce(self):
+        """Producer loop: fill the next slot when a trainer needs it"""
+        num_examples = len(self.labels)
+        epochs = len(self.permutations)
+        while True:
+            with self.cond:
+                slot = self.produced % self.slots
+                while (not self.cursors or
+                       self.produced >= max(self.cursors.values()) + self.prefetch or
+                       self.held[slot]):
+                    self.cond.wait()
+                seq = self.produced
+            offsets = self.offset + seq * self.batch_size + np.arange(self.batch_size)
+            indices = self.permutations[(offsets // num_examples) % epochs,
+                                        offsets % num_examples]
+            indices = np.sort(indices)
+            self.augment(self.images[indices], self.ring_images[slot])
+            self.ring_labels[slot] = self.labels[indices]
+            with self.cond:
+                self.produced += 1
+                self.cond.notify_all()
+
+    def serve(self, conn, client):
+        """Serve one trainer
+        Requests are ("next",), answered with (slot, seq) of a batch that is
+        held until ("release", slot)
+        """
+        with self.cond:
+            self.cursors[client] = self.produced
+            self.cond.notify_all()
+        conn.send((self.shm.name, self.slots))
+        held = []
+        try:
+            while True:
+                request = conn.recv()
+                with self.cond:
+                    if request[0] == "next":
+                        #Skip batches already overwritten while waiting
+                        while True:
+                            cursor = max(self.cursors[client],
+                                         self.produced - self.slots + 1)
+                            self.cursors[client] = cursor
+                            if cursor < self.produced:
+                                break
+                            self.cond.notify_all()
+                            self.cond.wait()
+                        slot = cursor % self.slots
+                        self.held[slot] += 1
+                        held.append(slot)
+                        self.cursors[client] = cursor + 1
+                        self.cond.notify_all()
+                    elif request[0] == "release":
+                        slot = request[1]
+                        self.held[slot] -= 1
+                        held.remove(slot)
+                        self.cond.notify_all()
+                        continue
+                conn.send((slot, cursor))
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+            with self.cond:
+                for slot in held:
+                    self.held[slot] -= 1
+                del self.cursors[client]
+                self.last_client = time.time()
+                self.cond.notify_all()
+
+    def watchdog(self):
+        """Exit when no trainer has been connected for idle seconds"""
+        while True:
+            time.sleep(1)
+            with self.cond:
+                if not self.cursors and time.time() - self.last_client > self.idle:
+                    break
+        self.shm.close()
+        self.shm.unlink()
+        os._exit(0)
+
+    def main(self):
+        listener = connection.Listener(self.address, family='AF_UNIX')
+        threading.Thread(target=self.produce, daemon=True).start()
+        threading.Thread(target=self.watchdog, daemon=True).start()
+        client = 0
+        while True:
+            conn = listener.accept()
+            client += 1
+            threading.Thread(target=self.serve, args=(conn, client),
+                             daemon=True).start()
+
+
+class DataClient:
+    """Connection of a trainer to the data server.
+
+    Starts the server if none is running for this cache and batch shape.
+    The lock file serializes trainers starting at the same time, so only
+    one server is started.
+    """
+    def __init__(self, images, labels, permutations, batch_size, image_size,
+                 slots=8, timeout=120):
+        self.batch_size = batch_size
+        self.image_size = image_size
+        address = server_address(images, batch_size, image_size)
+        self.conn = self.connect(address)
+        if self.conn is None:
+            lock = os.path.join(os.path.dirname(os.path.abspath(images)),
+                                'data_server.lock')
+            with open(lock, 'w') as flock:
+                fcntl.flock(flock, fcntl.LOCK_EX)
+                self.conn = self.connect(address)
+                if self.conn is None:
+                    cmd = [sys.executable, os.path.abspath(__file__),
+                           '--images', images, '--labels', labels,
+                           '--permutations', permutations,
+                           '--batch_size', str(batch_size),
+                           '--image_size', str(image_size),
+                           '--slots', str(slots)]
+                    subprocess.Popen(cmd, stdin=subprocess.DEVNULL,
+                                     start_new_session=True)
+                    deadline = time.time() + timeout
+                    while self.conn is None and time.time() < deadline:
+                        time.sleep(0.1)
+                        self.conn = self.connect(address)
+                    if self.conn is None:
+                        raise RuntimeError('Data server did not start')
+        name, slots = self.conn.recv()
+        self.shm = shared_memory.SharedMemory(name)
+        #The server owns the segment: do not let the resource tracker of
+        #this process unlink it at exit
+        resource_tracker.unregister(self.shm._name, 'shared_memory')
+        self.images, self.labels = slot_arrays(self.shm.buf, slots,
+                                               batch_size, image_size)
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def connect(address):
+        try:
+            return connection.Client(address, family='AF_UNIX')
+        except (FileNotFoundError, ConnectionRefusedError):
+            return None
+
+    def next_batch(self):
+        """Copy of the next batch: float32 images and int32 labels"""
+        with self.lock:
+            self.conn.send(("next",))
+            slot, _ = self.conn.recv()
+            images = self.images[slot].copy()
+            labels = self.labels[slot].copy()
+            self.conn.send(("release", slot))
+        return images, labels
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', help='Cached images (.npy)')
+    parser.add_argument('--labels', help='Cached labels (.npy)')
+    parser.add_argument('--permutations', help='Cached permutations (.npy)')
+    parser.add_argument('--batch_size', type=int, help='Batch size')
+    parser.add_argument('--image_size', type=int, help='Size of the crops')
+    parser.add_argument('--slots', type=int, default=8,
+                        help='Batches in the shared memory ring')
+    parser.add_argument('--idle', type=int, default=60,
+                        help='Seconds without trainers before exiting')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    server = DataServer(args.images, args.labels, args.permutations,
+                        args.batch_size, args.image_size, args.slots, args.idle)
+    server.main()
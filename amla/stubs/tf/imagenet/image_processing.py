@@ -22,6 +22,8 @@
  inputs: Construct batches of evaluation examples of images.
  distorted_inputs: Construct batches of training examples of images.
  batch_inputs: Construct batches of training or evaluation examples of images.
+ dataset_inputs: Construct batches of training or evaluation examples of images
+   using tf.data.
 
  -- Data processing:
  parse_example_proto: Parses an Example proto containing a training example
@@ -29,11 +31,17 @@
 
  -- Image decoding:
  decode_jpeg: Decode a JPEG encoded string into a 3-D float32 Tensor.
+ decode_and_crop_jpeg: Decode a window of a JPEG encoded string into a 3-D
+   float32 Tensor.
 
  -- Image preprocessing:
  image_preprocessing: Decode and preprocess one image for evaluation or training
  distort_image: Distort one image for training a network.
+ decode_and_distort_image: Decode and distort one image, decoding only the
+   distorted crop.
  eval_image: Prepare one image for evaluation.
+ decode_and_eval_image: Decode and prepare one image for evaluation, decoding
+   only the central crop.
  distort_color: Distort the color in one image for training.
 """
 from __future__ import absolute_import
@@ -73,7 +81,7 @@ tf.app.flags.DEFINE_integer(
     """comments in code for more details.""")
 
 
-def inputs(dataset, batch_size=None, num_preprocess_threads=None):
+def inputs(dataset, image_size, batch_size=None, num_preprocess_threads=None):
     """Generate batches of ImageNet images for evaluation.
 
     Use this function as the inputs for evaluating a network.
@@ -83,12 +91,13 @@ def inputs(dataset, batch_size=None, num_preprocess_threads=None):
 
     Args:
       dataset: instance of Dataset class specifying the dataset.
+      image_size: integer, size of the square images
       batch_size: integer, number of examples in batch
       num_preprocess_threads: integer, total number of preprocessing threads but
         None defaults to FLAGS.num_preprocess_threads.
 
     Returns:
-      images: Images. 4D tensor of size [batch_size, FLAGS.image_size,
+      images: Images. 4D tensor of size [batch_size, image_size,
                                          image_size, 3].
       labels: 1-D integer Tensor of [FLAGS.batch_size].
     """
@@ -99,14 +108,15 @@ def inputs(dataset, batch_size=None, num_preprocess_threads=None):
     # the forward inference and back-propagation.
     with tf.device('/cpu:0'):
         images, labels = batch_inputs(
-            dataset, batch_size, train=False,
+            dataset, batch_size, image_size, train=False,
             num_preprocess_threads=num_preprocess_threads,
             num_readers=1)
 
     return images, labels
 
 
-def distorted_inputs(dataset, batch_size=None, num_preprocess_threads=None):
+def distorted_inputs(dataset, image_size, batch_size=None,
+                     num_preprocess_threads=None):
     """Generate batches of distorted versions of ImageNet images.
 
     Use this function as the inputs for training a network.
@@ -117,13 +127,14 @@ def distorted_inputs(dataset, batch_size=None, num_preprocess_threads=None):
 
     Args:
       dataset: instance of Dataset class specifying the dataset.
+      image_size: integer, size of the square images
       batch_size: integer, number of examples in batch
       num_preprocess_threads: integer, total number of preprocessing threads but
         None defaults to FLAGS.num_preprocess_threads.
 
     Returns:
-      images: Images. 4D tensor of size [batch_size, FLAGS.image_size,
-                                         FLAGS.image_size, 3].
+      images: Images. 4D tensor of size [batch_size, image_size,
+                                         image_size, 3].
       labels: 1-D integer Tensor of [batch_size].
     """
     if not batch_size:
@@ -133,7 +144,7 @@ def distorted_inputs(dataset, batch_size=None, num_preprocess_threads=None):
     # the forward inference and back-propagation.
     with tf.device('/cpu:0'):
         images, labels = batch_inputs(
-            dataset, batch_size, train=True,
+            dataset, batch_size, image_size, train=True,
             num_preprocess_threads=num_preprocess_threads,
             num_readers=FLAGS.num_readers)
     return images, labels
@@ -303,7 +314,115 @@ def eval_image(image, height, width, scope=None):
         return image
 
 
-def image_preprocessing(image_buffer, bbox, train, thread_id=0):
+def decode_and_crop_jpeg(image_buffer, crop_window, scope=None):
+    """Decode a window of a JPEG string into one 3-D float image Tensor.
+
+    Only the window is decoded, which is cheaper than decoding the whole
+    image and cropping it.
+
+    Args:
+      image_buffer: scalar string Tensor.
+      crop_window: 1-D int32 Tensor [offset_height, offset_width, height, width].
+      scope: Optional scope for name_scope.
+    Returns:
+      3-D float Tensor with values ranging from [0, 1).
+    """
+    with tf.name_scope(values=[image_buffer, crop_window], name=scope,
+                       default_name='decode_and_crop_jpeg'):
+        image = tf.image.decode_and_crop_jpeg(image_buffer, crop_window,
+                                              channels=3)
+        image = tf.image.convert_image_dtype(image, dtype=tf.float32)
+        return image
+
+
+def decode_and_distort_image(image_buffer, height, width, bbox, scope=None):
+    """Decode and distort one image for training a network.
+
+    Same distortions as distort_image, but the distorted bounding box is
+    sampled from the JPEG header and only that box is decoded. The color
+    ordering, chosen per thread by distort_image, is chosen at random, and
+    images are resized bilinearly. No summaries are written, as this runs
+    inside a tf.data map.
+
+    Args:
+      image_buffer: JPEG encoded string Tensor
+      height: integer
+      width: integer
+      bbox: 3-D float Tensor of bounding boxes arranged [1, num_boxes, coords]
+        where each coordinate is [0, 1) and the coordinates are arranged
+        as [ymin, xmin, ymax, xmax].
+      scope: Optional scope for name_scope.
+    Returns:
+      3-D float Tensor of distorted image used for training.
+    """
+    with tf.name_scope(values=[image_buffer, height, width, bbox], name=scope,
+                       default_name='decode_and_distort_image'):
+        bbox_begin, bbox_size, _ = tf.image.sample_distorted_bounding_box(
+            tf.image.extract_jpeg_shape(image_buffer),
+            bounding_boxes=bbox,
+            min_object_covered=0.1,
+            aspect_ratio_range=[0.75, 1.33],
+            area_range=[0.05, 1.0],
+            max_attempts=100,
+            use_image_if_no_bounding_boxes=True)
+        offset_y, offset_x, _ = tf.unstack(bbox_begin)
+        target_height, target_width, _ = tf.unstack(bbox_size)
+        crop_window = tf.stack([offset_y, offset_x, target_height, target_width])
+        distorted_image = decode_and_crop_jpeg(image_buffer, crop_window)
+
+        distorted_image = tf.image.resize_images(distorted_image,
+                                                 [height, width])
+        distorted_image.set_shape([height, width, 3])
+
+        # Randomly flip the image horizontally.
+        distorted_image = tf.image.random_flip_left_right(distorted_image)
+
+        # Randomly distort the colors, in either ordering.
+        distorted_image = tf.cond(
+            tf.random_uniform([]) < 0.5,
+            lambda: distort_color(distorted_image, 0),
+            lambda: distort_color(distorted_image, 1))
+        distorted_image.set_shape([height, width, 3])
+        return distorted_image
+
+
+def decode_and_eval_image(image_buffer, height, width, scope=None):
+    """Decode and prepare one image for evaluation.
+
+    Same as eval_image, but only the central crop is decoded.
+
+    Args:
+      image_buffer: JPEG encoded string Tensor
+      height: integer
+      width: integer
+      scope: Optional scope for name_scope.
+    Returns:
+      3-D float Tensor of prepared image.
+    """
+    with tf.name_scope(values=[image_buffer, height, width], name=scope,
+                       default_name='decode_and_eval_image'):
+        # Crop the central region of the image with an area containing 87.5% of
+        # the original image, as tf.image.central_crop does.
+        shape = tf.image.extract_jpeg_shape(image_buffer)
+        image_height = shape[0]
+        image_width = shape[1]
+        offset_y = tf.cast(tf.cast(image_height, tf.float32) * 0.0625, tf.int32)
+        offset_x = tf.cast(tf.cast(image_width, tf.float32) * 0.0625, tf.int32)
+        crop_window = tf.stack([offset_y, offset_x,
+                                image_height - 2 * offset_y,
+                                image_width - 2 * offset_x])
+        image = decode_and_crop_jpeg(image_buffer, crop_window)
+
+        # Resize the image to the original height and width.
+        image = tf.expand_dims(image, 0)
+        image = tf.image.resize_bilinear(image, [height, width],
+                                         align_corners=False)
+        image = tf.squeeze(image, [0])
+        image.set_shape([height, width, 3])
+        return image
+
+
+def image_preprocessing(image_buffer, bbox, image_size, train, thread_id=0):
     """Decode and preprocess one image for evaluation or training.
 
     Args:
@@ -311,6 +430,7 @@ def image_preprocessing(image_buffer, bbox, train, thread_id=0):
       bbox: 3-D float Tensor of bounding boxes arranged [1, num_boxes, coords]
         where each coordinate is [0, 1) and the coordinates are arranged as
         [ymin, xmin, ymax, xmax].
+      image_size: integer, size of the square image
       train: boolean
       thread_id: integer indicating preprocessing thread
 
@@ -324,8 +444,8 @@ def image_preprocessing(image_buffer, bbox, train, thread_id=0):
         raise ValueError('Please supply a bounding box.')
 
     image = decode_jpeg(image_buffer)
-    height = FLAGS.image_size
-    width = FLAGS.image_size
+    height = image_size
+    width = image_size
 
     if train:
         image = distort_image(image, height, width, bbox, thread_id)
@@ -409,14 +529,15 @@ def parse_example_proto(example_serialized):
     return features['image/encoded'], label, bbox, features['image/class/text']
 
 
-def batch_inputs(dataset, batch_size, train, num_preprocess_threads=None,
-                 num_readers=1):
+def batch_inputs(dataset, batch_size, image_size, train,
+                 num_preprocess_threads=None, num_readers=1):
     """Contruct batches of training or evaluation examples from the image dataset.
 
     Args:
       dataset: instance of Dataset class specifying the dataset.
         See dataset.py for details.
       batch_size: integer
+      image_size: integer, size of the square images
       train: boolean
       num_preprocess_threads: integer, total number of preprocessing threads
       num_readers: integer, number of parallel readers
@@ -494,7 +615,8 @@ def batch_inputs(dataset, batch_size, train, num_preprocess_threads=None,
             # metadata.
             image_buffer, label_index, bbox, _ = parse_example_proto(
                 example_serialized)
-            image = image_preprocessing(image_buffer, bbox, train, thread_id)
+            image = image_preprocessing(image_buffer, bbox, image_size, train,
+                                        thread_id)
             images_and_labels.append([image, label_index])
 
         images, label_index_batch = tf.train.batch_join(
@@ -503,8 +625,8 @@ def batch_inputs(dataset, batch_size, train, num_preprocess_threads=None,
             capacity=2 * num_preprocess_threads * batch_size)
 
         # Reshape images into these desired dimensions.
-        height = FLAGS.image_size
-        width = FLAGS.image_size
+        height = image_size
+        width = image_size
         depth = 3
 
         images = tf.cast(images, tf.float32)
@@ -514,3 +636,75 @@ def batch_inputs(dataset, batch_size, train, num_preprocess_threads=None,
         tf.summary.image('images', images)
 
         return images, tf.reshape(label_index_batch, [batch_size])
+
+
+def dataset_inputs(dataset, batch_size, image_size, train,
+                   num_parallel_calls=16, num_readers=4,
+                   shuffle_buffer=10000):
+    """Contruct batches of training or evaluation examples using tf.data.
+
+    Shards are read num_readers at a time by a parallel interleave, and
+    examples are parsed, decoded and preprocessed by a parallel map, so
+    decode throughput scales with num_parallel_calls. Only the crop of each
+    JPEG is decoded.
+
+    Args:
+      dataset: instance of Dataset class specifying the dataset.
+        See dataset.py for details.
+      batch_size: integer
+      image_size: integer, size of the square images
+      train: boolean
+      num_parallel_calls: integer, number of examples preprocessed in parallel
+      num_readers: integer, number of shards read in parallel
+      shuffle_buffer: integer, number of examples shuffled during training
+
+    Returns:
+      images: 4-D float Tensor of a batch of images
+      labels: 1-D integer Tensor of [batch_size].
+
+    Raises:
+      ValueError: if data is not found
+    """
+    with tf.name_scope('batch_processing'):
+        data_files = dataset.data_files()
+        if data_files is None:
+            raise ValueError('No data files found for this dataset')
+
+        if num_readers < 1:
+            raise ValueError('Please make num_readers at least 1')
+
+        height = image_size
+        width = image_size
+
+        def preprocess(example_serialized):
+            image_buffer, label_index, bbox, _ = parse_example_proto(
+                example_serialized)
+            if train:
+                image = decode_and_distort_image(image_buffer, height, width,
+                                                 bbox)
+            else:
+                image = decode_and_eval_image(image_buffer, height, width)
+            # Finally, rescale to [-1,1] instead of [0, 1)
+            image = tf.subtract(image, 0.5)
+            image = tf.multiply(image, 2.0)
+            return image, tf.reshape(label_index, [])
+
+        files = tf.data.Dataset.from_tensor_slices(data_files)
+        if train:
+            files = files.shuffle(len(data_files))
+        files = files.repeat()
+        examples = files.apply(tf.contrib.data.parallel_interleave(
+            tf.data.TFRecordDataset, cycle_length=num_readers, sloppy=train))
+        if train:
+            examples = examples.shuffle(shuffle_buffer)
+        examples = examples.map(preprocess,
+                                num_parallel_calls=num_parallel_calls)
+        examples = examples.batch(batch_size).prefetch(2)
+        images, labels = examples.make_one_shot_iterator().get_next()
+        images.set_shape([batch_size, height, width, 3])
+        labels.set_shape([batch_size])
+
+        # Display the training images in the visualizer.
+        tf.summary.image('images', images)
+
+        return images, labels
@@ -25,8 +25,8 @@ from stubs.tf.imagenet.dataset import Dataset
 class ImagenetData(Dataset):
     """ImageNet data set."""
 
-    def __init__(self, subset):
-        super(ImagenetData, self).__init__('ImageNet', subset)
+    def __init__(self, subset, data_dir):
+        super(ImagenetData, self).__init__('ImageNet', subset, data_dir)
 
     def num_classes(self):
         """Returns the number of classes in the data set."""
@@ -48,7 +48,7 @@ class ImagenetData(Dataset):
         print('')
         print(
             'If you have already downloaded and processed the data, then make '
-            'sure to set --data_dir to point to the directory containing the '
+            'sure to set data_dir to point to the directory containing the '
             'location of the sharded TFRecords.\n')
         print(
             'If you have not downloaded and prepared the ImageNet data in the '
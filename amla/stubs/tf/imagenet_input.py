@@ -14,21 +14,47 @@
 """Imagenet input functions"""
 
 import tensorflow as tf
+
 from stubs.tf.imagenet.imagenet_data import ImagenetData
 import stubs.tf.imagenet.image_processing as imgnet
 
-FLAGS = tf.app.flags.FLAGS
 
-def distorted_inputs():
-    dataset = ImagenetData(FLAGS.dataset_split_name)
+def distorted_inputs(data_dir, batch_size, image_size):
+    dataset = ImagenetData('train', data_dir)
     images, labels = imgnet.distorted_inputs(
         dataset,
+        image_size,
+        batch_size=batch_size,
         num_preprocess_threads=4
     )
     return images, labels
 
 
-def inputs():
-    dataset = ImagenetData(FLAGS.dataset_split_name)
-    images, labels = imgnet.inputs(dataset)
+def inputs(eval_data, data_dir, batch_size, image_size):
+    dataset = ImagenetData('validation' if eval_data else 'train', data_dir)
+    images, labels = imgnet.inputs(dataset, image_size, batch_size=batch_size)
+    return images, labels
+
+
+def dataset_distorted_inputs(data_dir, batch_size, image_size,
+                             num_parallel_calls=16, num_readers=4,
+                             shuffle_buffer=10000):
+    dataset = ImagenetData('train', data_dir)
+    with tf.device('/cpu:0'):
+        images, labels = imgnet.dataset_inputs(
+            dataset, batch_size, image_size, train=True,
+            num_parallel_calls=num_parallel_calls,
+            num_readers=num_readers,
+            shuffle_buffer=shuffle_buffer)
+    return images, labels
+
+
+def dataset_inputs(eval_data, data_dir, batch_size, image_size,
+                   num_parallel_calls=16, num_readers=4):
+    dataset = ImagenetData('validation' if eval_data else 'train', data_dir)
+    with tf.device('/cpu:0'):
+        images, labels = imgnet.dataset_inputs(
+            dataset, batch_size, image_size, train=False,
+            num_parallel_calls=num_parallel_calls,
+            num_readers=num_readers)
     return images, labels
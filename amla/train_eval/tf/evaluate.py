@@ -31,13 +31,16 @@ import tensorflow as tf
 
 FLAGS = tf.app.flags.FLAGS
 
-tf.app.flags.DEFINE_string('config', './configs/config.json',
-                           """Configuration file""")
-tf.app.flags.DEFINE_string('base_dir', '.',
-                           """Working directory to run from""")
-tf.app.flags.DEFINE_string('task', '.',
-                           """Task information""")
-sys.path.insert(0, FLAGS.base_dir)
+# Flags are only defined when run as a process: train and evaluate define
+# the same flags, and may both be imported by the scheduler (library mode)
+if __name__ == '__main__':
+    tf.app.flags.DEFINE_string('config', './configs/config.json',
+                               """Configuration file""")
+    tf.app.flags.DEFINE_string('base_dir', '.',
+                               """Working directory to run from""")
+    tf.app.flags.DEFINE_string('task', '.',
+                               """Task information""")
+    sys.path.insert(0, FLAGS.base_dir)
 from train_eval.tf import net
 from common.task import Task
 
@@ -46,13 +49,20 @@ class Evaluate(Task):
     """Evaluate task
     """
 
-    def __init__(self, base_dir, config, task):
+    def __init__(self, base_dir, config, task, log=None):
         super().__init__(base_dir)
         self.name = 'evaluate'
         self.task_config_key = config
         self.task_config = self.read(self.task_config_key)
         self.base_dir = base_dir
-        self.task = json.loads(task)
+        # The task is a JSON string when run as a process, a dict when run
+        # as a library
+        if isinstance(task, str):
+            self.task = json.loads(task)
+        else:
+            self.task = dict(task)
+        # Log file of the task when run as a library
+        self.log = log
         self.iteration = self.task['iteration']
         self.get_task_params()
 
@@ -90,13 +100,24 @@ class Evaluate(Task):
         """
         with tf.Session() as sess:
             ckpt = tf.train.get_checkpoint_state(self.checkpoint_dir)
+            model_checkpoint_path = None
             if ckpt and ckpt.model_checkpoint_path:
+                model_checkpoint_path = ckpt.model_checkpoint_path
+            if 'checkpoint' in self.task and self.task['checkpoint']:
+                # Evaluate the checkpoint requested by a persistent or
+                # pipelined trainer, which may have saved newer ones since
+                if not tf.train.checkpoint_exists(self.task['checkpoint']):
+                    print("Error: Checkpoint " + self.task['checkpoint'] +
+                          " not found")
+                    return
+                model_checkpoint_path = self.task['checkpoint']
+            if model_checkpoint_path:
                 # Restores from checkpoint
-                saver.restore(sess, ckpt.model_checkpoint_path)
+                saver.restore(sess, model_checkpoint_path)
                 # Assuming model_checkpoint_path looks something like:
                 #   /my-favorite-path/cifar10_train/model.ckpt-0,
                 # extract global_step from it.
-                global_step = ckpt.model_checkpoint_path.split(
+                global_step = model_checkpoint_path.split(
                     '/')[-1].split('-')[-1]
             else:
                 print('No checkpoint file found')
@@ -131,14 +152,18 @@ class Evaluate(Task):
                     # Compute precision @ 1.
                     precision = true_count / total_sample_count
                     print(
-                        '%s: precision @ 1 = %.3f' %
-                        (datetime.now(), precision))
+                        '%s: step %s, precision @ 1 = %.3f' %
+                        (datetime.now(), global_step, precision))
                 elif k == 5:
                     # Compute precision @ 5.
                     precision = true_count / total_sample_count
                     print(
-                        '%s: precision @ 5 = %.3f' %
-                        (datetime.now(), precision))
+                        '%s: step %s, precision @ 5 = %.3f' %
+                        (datetime.now(), global_step, precision))
+                if self.log is not None:
+                    self.log.write('%s: step %s, precision @ %d = %.3f\n' %
+                                   (datetime.now(), global_step, k, precision))
+                    self.log.flush()
 
                 summary = tf.Summary()
                 summary.ParseFromString(sess.run(summary_op))
@@ -216,7 +241,8 @@ class Evaluate(Task):
         if not tf.gfile.Exists(self.eval_dir):
             tf.gfile.MakeDirs(self.eval_dir)
         self.evaluate(network)
-        if self.sys_config['exec']['scheduler'] == "service":
+        if self.sys_config['exec']['scheduler'] == "service" and \
+                self.sys_config['exec'][self.name] != "library":
              self.put_results()
 
     def put_results(self):
@@ -36,6 +36,7 @@ from stubs.tf import cell_init
 from stubs.tf import cell_classification
 from stubs.tf import cell_main
 from stubs.tf import cifar10_input
+from stubs.tf import cache_input
 from stubs.tf import imagenet_input
 
 
@@ -80,6 +81,49 @@ class Net:
         self.data_dir = self.base_dir + "/" + \
             self.task_config["parameters"]["data_dir"]
         self.arch = self.task_config["arch"]
+        # Input pipeline: "queue" (queue runners), "dataset" (tf.data),
+        # "mmap" (tf.data over a memory mapped cache of decoded images) or
+        # "server" (training batches distorted by the data server of the
+        # host, shared by all trainers, evaluation as "mmap")
+        self.input_pipeline = "queue"
+        if "input_pipeline" in self.task_config["parameters"]:
+            self.input_pipeline = self.task_config["parameters"]["input_pipeline"]
+        self.input_threads = 16
+        if "input_threads" in self.task_config["parameters"]:
+            self.input_threads = int(self.task_config["parameters"]["input_threads"])
+        # Shards read in parallel and shuffle buffer of the tf.data ImageNet
+        # pipeline
+        self.input_readers = 4
+        if "input_readers" in self.task_config["parameters"]:
+            self.input_readers = int(self.task_config["parameters"]["input_readers"])
+        self.shuffle_buffer = 10000
+        if "shuffle_buffer" in self.task_config["parameters"]:
+            self.shuffle_buffer = int(self.task_config["parameters"]["shuffle_buffer"])
+        # Resized dataset cache written by preprocess.py: used instead of
+        # the dataset (and input_pipeline) when use_resized_cache is set
+        self.use_resized_cache = False
+        if "use_resized_cache" in self.task_config["parameters"]:
+            self.use_resized_cache = self.task_config["parameters"]["use_resized_cache"]
+        self.cache_policy = "center"
+        if "cache_policy" in self.task_config["parameters"]:
+            self.cache_policy = self.task_config["parameters"]["cache_policy"]
+        # Envelope cell statistics: printed to the log, or collected for
+        # the trainer to write to a binary record log
+        self.stats_format = "log"
+        if "stats_format" in self.task_config["parameters"]:
+            self.stats_format = self.task_config["parameters"]["stats_format"]
+        # Envelope cell statistics accumulators: "full" keeps sums for each
+        # element of the feature map, "welford" keeps running moments for
+        # each channel
+        self.stats = "full"
+        if "stats" in self.task_config["parameters"]:
+            self.stats = self.task_config["parameters"]["stats"]
+        # Steps between exports of the statistics by the trainer. If not
+        # set, "log" statistics are printed every step
+        self.stats_interval = None
+        if "stats_interval" in self.task_config["parameters"]:
+            self.stats_interval = int(
+                self.task_config["parameters"]["stats_interval"])
 
     def _activation_summary(self, x):
         """Helper to create summaries for activations.
@@ -155,12 +199,37 @@ class Net:
         """
         if not self.data_dir:
             raise ValueError('Please supply a data_dir')
-        if self.dataset == 'cifar10':
+        resized_cache_dir = self.resized_cache_dir()
+        if resized_cache_dir:
+            images, labels = cache_input.distorted_inputs(
+                directory=resized_cache_dir, dataset=self.dataset, batch_size=self.batch_size,
+                image_size=self.image_size, num_parallel_calls=self.input_threads,
+                num_readers=self.input_readers, shuffle_buffer=self.shuffle_buffer)
+        elif self.dataset == 'cifar10':
             data_dir = os.path.join(self.data_dir, 'cifar-10-batches-bin')
-            images, labels = cifar10_input.distorted_inputs(
-                data_dir=data_dir, batch_size=self.batch_size, image_size=self.image_size)
+            if self.input_pipeline == "server":
+                images, labels = cifar10_input.server_distorted_inputs(
+                    cache_dir=self.cache_dir(), batch_size=self.batch_size, image_size=self.image_size)
+            elif self.input_pipeline == "mmap":
+                images, labels = cifar10_input.mmap_distorted_inputs(
+                    cache_dir=self.cache_dir(), batch_size=self.batch_size, image_size=self.image_size,
+                    num_parallel_calls=self.input_threads)
+            elif self.input_pipeline == "dataset":
+                images, labels = cifar10_input.dataset_distorted_inputs(
+                    data_dir=data_dir, batch_size=self.batch_size, image_size=self.image_size,
+                    num_parallel_calls=self.input_threads)
+            else:
+                images, labels = cifar10_input.distorted_inputs(
+                    data_dir=data_dir, batch_size=self.batch_size, image_size=self.image_size)
         elif self.dataset == 'imagenet':
-            images, labels = imagenet_input.distorted_inputs()
+            if self.input_pipeline == "dataset":
+                images, labels = imagenet_input.dataset_distorted_inputs(
+                    data_dir=self.data_dir, batch_size=self.batch_size, image_size=self.image_size,
+                    num_parallel_calls=self.input_threads, num_readers=self.input_readers,
+                    shuffle_buffer=self.shuffle_buffer)
+            else:
+                images, labels = imagenet_input.distorted_inputs(
+                    data_dir=self.data_dir, batch_size=self.batch_size, image_size=self.image_size)
         if self.use_fp16:
             images = tf.cast(images, tf.float16)
             labels = tf.cast(labels, tf.float16)
@@ -181,15 +250,33 @@ class Net:
         """
         if not self.data_dir:
             raise ValueError('Please supply a data_dir')
-        if self.dataset == 'cifar10':
+        resized_cache_dir = self.resized_cache_dir()
+        if resized_cache_dir:
+            images, labels = cache_input.inputs(
+                eval_data=eval_data, directory=resized_cache_dir, dataset=self.dataset,
+                batch_size=self.batch_size, image_size=self.image_size,
+                num_parallel_calls=self.input_threads, num_readers=self.input_readers)
+        elif self.dataset == 'cifar10':
             data_dir = os.path.join(self.data_dir, 'cifar-10-batches-bin')
-            images, labels = cifar10_input.inputs(
-                eval_data=eval_data, data_dir=data_dir, batch_size=self.batch_size, image_size=self.image_size)
+            if self.input_pipeline in ["mmap", "server"]:
+                images, labels = cifar10_input.mmap_inputs(
+                    eval_data=eval_data, cache_dir=self.cache_dir(), batch_size=self.batch_size, image_size=self.image_size,
+                    num_parallel_calls=self.input_threads)
+            elif self.input_pipeline == "dataset":
+                images, labels = cifar10_input.dataset_inputs(
+                    eval_data=eval_data, data_dir=data_dir, batch_size=self.batch_size, image_size=self.image_size,
+                    num_parallel_calls=self.input_threads)
+            else:
+                images, labels = cifar10_input.inputs(
+                    eval_data=eval_data, data_dir=data_dir, batch_size=self.batch_size, image_size=self.image_size)
         elif self.dataset == 'imagenet':
-            data_dir = self.data_dir
-            if self.dataset_split_name == "test":
-                self.dataset_split_name = "validation"
-            images, labels = imagenet_input.inputs()
+            if self.input_pipeline == "dataset":
+                images, labels = imagenet_input.dataset_inputs(
+                    eval_data=eval_data, data_dir=self.data_dir, batch_size=self.batch_size, image_size=self.image_size,
+                    num_parallel_calls=self.input_threads, num_readers=self.input_readers)
+            else:
+                images, labels = imagenet_input.inputs(
+                    eval_data=eval_data, data_dir=self.data_dir, batch_size=self.batch_size, image_size=self.image_size)
         if self.use_fp16:
             images = tf.cast(images, tf.float16)
             labels = tf.cast(labels, tf.float16)
@@ -425,6 +512,9 @@ class Net:
                 dest_directory, 'cifar-10-batches-bin')
             if not os.path.exists(extracted_dir_path):
                 tarfile.open(filepath, 'r:gz').extractall(dest_directory)
+            if self.input_pipeline in ["mmap", "server"]:
+                cifar10_input.maybe_build_cache(extracted_dir_path,
+                                                self.cache_dir())
         elif self.dataset == 'imagenet':
             """ It is assumed that if imagenet dataset is specified then it already exists
                 and not supposed to be downloaded
@@ -436,6 +526,24 @@ class Net:
             print("Unknown dataset {}".format(self.dataset))
             exit(-1)
 
+    def cache_dir(self):
+        """Directory of the memory mapped cache of the decoded dataset"""
+        return os.path.join(self.data_dir, 'cache', self.dataset + '-mmap')
+
+    def resized_cache_dir(self):
+        """Directory of the dataset resized to image_size by preprocess.py
+        None if use_resized_cache is not set, or the cache is missing
+        """
+        if not self.use_resized_cache:
+            return None
+        directory = cache_input.cache_dir(self.data_dir, self.dataset,
+                                          self.image_size, self.cache_policy)
+        if not tf.gfile.IsDirectory(directory):
+            print("Warning: No resized cache at " + directory +
+                  ", run train_eval/tf/preprocess.py. Using " + self.input_pipeline)
+            return None
+        return directory
+
     def add_init(self, inputs, arch, is_training):
         init = cell_init.Init(0, self)
         net = init.cell(inputs, arch, is_training)
@@ -0,0 +1,80 @@
+# Copyright 2018 Cisco Systems All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Write the resized dataset cache of a configuration
+
+Decodes the dataset of the configuration once, resizes it for the
+image_size of the configuration and writes it to
+<data_dir>/cache/<dataset>-<image_size>-<cache_policy> (see
+stubs/tf/cache_input.py). Training and evaluation tasks with the same
+dataset, image_size and cache_policy read the cache instead of the dataset
+if they set use_resized_cache.
+
+python train_eval/tf/preprocess.py --base_dir=. \
+    --config=configs/config.nac.construction.json
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import json
+
+import tensorflow as tf
+
+FLAGS = tf.app.flags.FLAGS
+
+if __name__ == '__main__':
+    tf.app.flags.DEFINE_string('config', './configs/config.json',
+                               """Configuration file""")
+    tf.app.flags.DEFINE_string('base_dir', '.',
+                               """Working directory to run from""")
+    tf.app.flags.DEFINE_integer('image_size', 0,
+                                """Image size, if not that of the configuration""")
+    tf.app.flags.DEFINE_string('cache_policy', '',
+                               """Crop policy (center or resize), if not that """
+                               """of the configuration""")
+    tf.app.flags.DEFINE_integer('shard_size', 10000,
+                                """Examples per shard""")
+    tf.app.flags.DEFINE_integer('threads', 16,
+                                """Images decoded in parallel""")
+    sys.path.insert(0, FLAGS.base_dir)
+from stubs.tf import cache_input
+
+
+def main(argv=None):  # pylint: disable=unused-argument
+    with open(FLAGS.base_dir + "/" + FLAGS.config, 'r') as fread:
+        parameters = json.load(fread)["parameters"]
+    dataset = parameters["dataset"]
+    data_dir = FLAGS.base_dir + "/" + parameters["data_dir"]
+    image_size = parameters["image_size"]
+    if FLAGS.image_size:
+        image_size = FLAGS.image_size
+    cache_policy = "center"
+    if "cache_policy" in parameters:
+        cache_policy = parameters["cache_policy"]
+    if FLAGS.cache_policy:
+        cache_policy = FLAGS.cache_policy
+    if cache_policy not in cache_input.POLICIES:
+        print("Error: Invalid cache policy " + cache_policy)
+        print("Should be one of " + ", ".join(cache_input.POLICIES))
+        exit(-1)
+    directory = cache_input.write_cache(dataset, data_dir, int(image_size),
+                                        cache_policy,
+                                        shard_size=FLAGS.shard_size,
+                                        num_parallel_calls=FLAGS.threads)
+    print("Cache: " + directory)
+
+
+if __name__ == '__main__':
+    tf.app.run()
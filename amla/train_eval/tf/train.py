@@ -22,6 +22,7 @@ from __future__ import print_function
 
 from datetime import datetime
 import ast
+import re
 import sys
 import time
 import json
@@ -30,14 +31,18 @@ import tensorflow as tf
 
 FLAGS = tf.app.flags.FLAGS
 
-tf.app.flags.DEFINE_string('config', './configs/config.json',
-                           """Configuration file""")
-tf.app.flags.DEFINE_string('base_dir', '.',
-                           """Working directory to run from""")
-tf.app.flags.DEFINE_string('task', '.',
-                           """Task information""")
-sys.path.insert(0, FLAGS.base_dir)
+# Flags are only defined when run as a process: train and evaluate define
+# the same flags, and may both be imported by the scheduler (library mode)
+if __name__ == '__main__':
+    tf.app.flags.DEFINE_string('config', './configs/config.json',
+                               """Configuration file""")
+    tf.app.flags.DEFINE_string('base_dir', '.',
+                               """Working directory to run from""")
+    tf.app.flags.DEFINE_string('task', '.',
+                               """Task information""")
+    sys.path.insert(0, FLAGS.base_dir)
 from train_eval.tf import net
+from stubs.tf import cell_main
 from common.task import Task
 
 # Globals needed by log hook
@@ -49,13 +54,23 @@ class Train(Task):
     """Trainingtask
     """
 
-    def __init__(self, base_dir, config, task):
+    def __init__(self, base_dir, config, task, evaluate_callback=None,
+                 log=None):
         super().__init__(base_dir)
         self.name = 'train'
         self.task_config_key = config
         self.task_config = self.read(self.task_config_key)
         self.base_dir = base_dir
-        self.task = json.loads(task)
+        # The task is a JSON string when run as a process, a dict when run
+        # as a library
+        if isinstance(task, str):
+            self.task = json.loads(task)
+        else:
+            self.task = dict(task)
+        # Called with checkpoints to evaluate when run as a library
+        self.evaluate_callback = evaluate_callback
+        # Log file of the task when run as a library, else stderr
+        self.log = log if log is not None else sys.stderr
         self.iteration = self.task['iteration']
         self.max_steps = self.task['steps']
         self.get_task_params()
@@ -103,6 +118,31 @@ class Train(Task):
         #self.data_dir = self.base_dir + "/" + \
         #    self.task_config["parameters"]["data_dir"] + '/' + str(self.iteration)+"/train"
         self.gpus = self.task_config["parameters"]["gpus"]
+        # Persistent: train all steps in one process, saving a checkpoint
+        # and requesting its evaluation every eval_interval steps
+        self.persistent = False
+        if "persistent_train" in self.task_config["parameters"]:
+            self.persistent = self.task_config["parameters"]["persistent_train"]
+        # Pipelined: the checkpoint at the end of each segment is evaluated
+        # while the next segment trains, so it must not be rotated out
+        self.pipelined = False
+        if "pipeline_eval" in self.task_config["parameters"]:
+            self.pipelined = self.task_config["parameters"]["pipeline_eval"]
+        self.stats_format = "log"
+        if "stats_format" in self.task_config["parameters"]:
+            self.stats_format = self.task_config["parameters"]["stats_format"]
+        self.stats_interval = None
+        if "stats_interval" in self.task_config["parameters"]:
+            self.stats_interval = int(
+                self.task_config["parameters"]["stats_interval"])
+        # tf.Print writes to the stderr of the process, which library tasks
+        # share, so they export the statistics to their log every step
+        if self.log is not sys.stderr and self.stats_format == "log" and \
+                not self.stats_interval:
+            self.stats_interval = 1
+            self.task_config["parameters"]["stats_interval"] = 1
+        self.stats_key = "results/" + self.arch_name + "/" + \
+            str(self.iteration) + "/train/stats.bin"
         self.arch = self.task_config["arch"]
         global_batch_size = self.batch_size
         self.train_dir = self.base_dir + "/results/" + \
@@ -161,6 +201,8 @@ class Train(Task):
             # Build a Graph that trains the model with one batch of examples and
             # updates the model parameters.
             train_op = network.train(loss, global_step)
+            if global_step_init == -1:
+                self.inherit_weights()
 
             class _LoggerHook(tf.train.SessionRunHook):
                 """Logs loss and runtime."""
@@ -216,8 +258,10 @@ class Train(Task):
                     checkpoint_dir=self.train_dir,
                     hooks=[tf.train.StopAtStepHook(last_step=self.max_steps),
                            tf.train.NanTensorHook(loss),
-                           _LoggerHook()],
-                    save_checkpoint_secs=300,
+                           _LoggerHook()] +
+                    self.checkpoint_hooks(saver, global_step_init) +
+                    self.stats_hooks(global_step, global_step_init),
+                    save_checkpoint_secs=self.checkpoint_secs(),
                     save_summaries_steps=100,
                     config=tf.ConfigProto(
                         log_device_placement=self.log_device_placement)) as mon_sess:
@@ -324,6 +368,8 @@ class Train(Task):
                 tf.trainable_variables())
 
             train_op = tf.group(apply_gradient_op, variables_averages_op)
+            if global_step_init == -1:
+                self.inherit_weights()
 
             class _LoggerHook(tf.train.SessionRunHook):
                 """Logs loss and runtime."""
@@ -367,8 +413,10 @@ class Train(Task):
                 checkpoint_dir=self.train_dir,
                 hooks=[tf.train.StopAtStepHook(last_step=self.max_steps),
                        tf.train.NanTensorHook(loss),
-                       _LoggerHook()],
-                save_checkpoint_secs=300,
+                       _LoggerHook()] +
+                self.checkpoint_hooks(saver, global_step_init) +
+                self.stats_hooks(global_step, global_step_init),
+                save_checkpoint_secs=self.checkpoint_secs(),
                 save_summaries_steps=100,
                 config=tf.ConfigProto(
                     log_device_placement=self.log_device_placement,
@@ -394,15 +442,206 @@ class Train(Task):
             self.train(network)
         else:
             self.multi_gpu_train(network)
-        if self.sys_config['exec']['scheduler'] == "service":
+        # As a library, the scheduler reads the results with get_results
+        if self.sys_config['exec']['scheduler'] == "service" and \
+                self.sys_config['exec'][self.name] != "library":
              self.put_results()
 
-    def put_results(self):
-        task = {"task_id": int(self.task['task_id']), "op": "POST"}
+    def checkpoint_secs(self):
+        """Interval of the time based checkpoints of the training session
+        None when checkpoint_hooks saves the checkpoints instead
+        """
+        if self.persistent or self.pipelined:
+            return None
+        return 300
+
+    def checkpoint_hooks(self, saver, global_step_init):
+        """Hooks for persistent and pipelined training
+        Persistent: save a checkpoint every eval_interval steps and ask the
+        scheduler to evaluate it. Training continues while the checkpoint is
+        evaluated
+        Pipelined: save checkpoints only at segment boundaries, so the
+        segment checkpoint under evaluation is not rotated out by time based
+        checkpoints of the next segment
+        """
+        if self.pipelined and not self.persistent:
+            return [tf.train.CheckpointSaverHook(
+                self.train_dir,
+                save_steps=int(self.eval_interval),
+                saver=saver)]
+        if not self.persistent:
+            return []
+        train = self
+
+        class _EvaluateListener(tf.train.CheckpointSaverListener):
+            """Requests evaluation of each interval checkpoint."""
+
+            def begin(self):
+                # global_step_init is -1 on a fresh run: the untrained
+                # checkpoint of step 0 is not evaluated either
+                self._last_step = max(global_step_init, 0)
+
+            def after_save(self, session, global_step_value):
+                # Skip the checkpoint saved on session creation (the restored
+                # step, or step 0), and repeats
+                if global_step_value <= self._last_step:
+                    return
+                if global_step_value % int(train.eval_interval) != 0 and \
+                        global_step_value != train.max_steps:
+                    return
+                self._last_step = global_step_value
+                train.request_evaluation(
+                    global_step_value, tf.train.latest_checkpoint(train.train_dir))
+
+        return [tf.train.CheckpointSaverHook(
+            self.train_dir,
+            save_steps=int(self.eval_interval),
+            saver=saver,
+            listeners=[_EvaluateListener()])]
+
+    def inherit_weights(self):
+        """Initialize from the checkpoint of the previous construction
+        iteration (config "inherit", written by Generate)
+        Cells kept from the previous arch are mapped by renumbering their
+        scopes. Variables of new cells, variables whose shape changed, the
+        global step and the envelope statistics keep their initializers
+        """
+        if "inherit" not in self.task_config:
+            return
+        inherit = self.task_config["inherit"]
+        prev_dir = self.base_dir + "/results/" + self.arch_name + "/" + \
+            str(inherit["iteration"]) + "/train"
+        ckpt = tf.train.latest_checkpoint(prev_dir)
+        if ckpt is None:
+            print("Warning: No checkpoint to inherit weights from in " + prev_dir)
+            return
+        shapes = dict(tf.train.list_variables(ckpt))
+        cells = {}
+        for old, new in inherit["cells"].items():
+            cells[int(new)] = int(old)
+
+        def rename(match):
+            cellidx = int(match.group(2))
+            if cellidx not in cells:
+                raise KeyError(cellidx)
+            return match.group(1) + str(cells[cellidx])
+
+        assignment_map = {}
+        variables = tf.global_variables()
+        for var in variables:
+            name = var.op.name
+            if name.split("/")[-1] in ("global_step",) + cell_main.STATS_VARIABLES:
+                continue
+            try:
+                old_name = re.sub(
+                    r"((?:^|/)Cell|Widener_|BottleneckLayer_1x1_Envelope_)(\d+)",
+                    rename, name)
+            except KeyError:
+                # New cell
+                continue
+            if old_name in shapes and shapes[old_name] == var.shape.as_list():
+                assignment_map[old_name] = var
+        tf.train.init_from_checkpoint(ckpt, assignment_map)
+        print("Inherited %d of %d variables from %s" %
+              (len(assignment_map), len(variables), ckpt))
+
+    def stats_hooks(self, global_step, global_step_init):
+        """Hooks to export envelope cell statistics
+        The statistics are accumulated in the graph every step and exported
+        every stats_interval steps (every step if not set), and when
+        training ends. With the "binary" stats_format, they are written to a
+        binary record log, else printed to the training log. Generate reads
+        the last export
+        """
+        binary = self.log_stats and self.stats_format == "binary"
+        if global_step_init == -1 and not binary:
+            # A new training run: Generate must not read the record log of
+            # an earlier one
+            self.store.delete(self.stats_key)
+        if not self.log_stats or (self.stats_format != "binary" and
+                                  not self.stats_interval):
+            return []
+        # With multiple towers, the statistics of the first one are exported
+        names = []
+        values = []
+        for name, value in zip(tf.get_collection(cell_main.STATS_NAMES),
+                               tf.get_collection(cell_main.STATS_VALUES)):
+            if name not in names:
+                names.append(name)
+                values.append(value)
+        interval = self.stats_interval if self.stats_interval else 1
+        store = self.store
+        key = self.stats_key
+        if global_step_init == -1 and binary:
+            store.create_records(key, names)
+        log = self.log
+
+        class _StatsHook(tf.train.SessionRunHook):
+            """Exports the statistics every interval steps."""
+
+            def begin(self):
+                self._records = []
+                self._last_step = None
+
+            def after_create_session(self, session, coord):
+                self._step = int(session.run(global_step))
+
+            def before_run(self, run_context):
+                self._step += 1
+                if self._step % interval != 0:
+                    return None
+                return tf.train.SessionRunArgs(values)
+
+            def after_run(self, run_context, run_values):
+                if run_values.results is not None:
+                    self.export(self._step, run_values.results)
+
+            def end(self, session):
+                step = int(session.run(global_step))
+                if step != self._last_step:
+                    self.export(step, session.run(values))
+                self.flush()
+
+            def export(self, step, stats):
+                self._last_step = step
+                if not binary:
+                    for name, value in zip(names, stats):
+                        log.write("%s:[%.8g]\n" % (name, value))
+                    return
+                self._records.append((step, stats))
+                # Batch small writes
+                if len(self._records) * interval >= 100:
+                    self.flush()
+
+            def flush(self):
+                if self._records:
+                    store.append_records(key, names, self._records)
+                    self._records = []
+                log.flush()
+
+        return [_StatsHook()]
+
+    def request_evaluation(self, step, checkpoint):
+        request = {"task_id": int(self.task['task_id']),
+                   "steps": int(step),
+                   "checkpoint": checkpoint}
+        if self.evaluate_callback is not None:
+            self.evaluate_callback(request)
+        elif self.sys_config['exec']['scheduler'] == "service":
+            request["op"] = "POST"
+            self.send_request("scheduler", "tasks/evaluate", request)
+
+    def get_results(self):
+        task = {"task_id": int(self.task['task_id'])}
         if self.task["steps"] == self.task_config["parameters"]["steps"]:
             task['state'] = "complete"
         else:
             task['state'] = "running"
+        return task
+
+    def put_results(self):
+        task = self.get_results()
+        task["op"] = "POST"
         self.send_request("scheduler", "tasks/update", task)
 
 